@@ -19,6 +19,9 @@ python manage.py syncdb --noinput
 echo 'Running migrations.'
 python manage.py migrate --noinput
 
+echo 'Creating MongoDB indexes.'
+python manage.py create_mongo_indexes || echo 'WARNING: Could not create MongoDB indexes. Run \`python manage.py create_mongo_indexes\` once with a user allowed to create indexes on \`instances\`.'
+
 if [[ ! -L "${KPI_SRC_DIR}/node_modules" ]] || [[ ! -d "${KPI_SRC_DIR}/node_modules" ]]; then
     echo "Restoring \`npm\` packages to \`${KPI_SRC_DIR}/node_modules\`."
     rm -rf "${KPI_SRC_DIR}/node_modules"
@@ -3,4 +3,4 @@ HOOK_LOG_FAILED = 0
 HOOK_LOG_PENDING = 1
 HOOK_LOG_SUCCESS = 2
 
-KOBO_INTERNAL_ERROR_STATUS_CODE = None
\ No newline at end of file
+KOBO_INTERNAL_ERROR_STATUS_CODE = None
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from kobo.apps.hook.models import Hook
+
+
+class Command(BaseCommand):
+    help = ('Count the logs of each hook per status and fix the counters '
+            'stored on hooks which do not match')
+    option_list = BaseCommand.option_list + (
+        make_option('--asset-uid',
+                    action='store',
+                    dest='asset_uid',
+                    default=None,
+                    help='Only reconcile the hooks of this asset'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        hooks = Hook.objects.only('pk', 'uid').order_by('pk')
+        if options['asset_uid']:
+            hooks = hooks.filter(asset__uid=options['asset_uid'])
+
+        checked = fixed = 0
+        for hook in hooks.iterator():
+            checked += 1
+            if hook.reconcile_counts():
+                fixed += 1
+                if verbosity > 1:
+                    self.stdout.write('Fixed counters of hook {}'.format(
+                        hook.uid))
+
+        if verbosity:
+            self.stdout.write('Checked {} hooks; fixed {}'.format(
+                checked, fixed))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hook', '0003_add_subset_fields_to_hook_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hook',
+            name='batch_delivery',
+            field=models.BooleanField(default=False),
+        ),
+    ]
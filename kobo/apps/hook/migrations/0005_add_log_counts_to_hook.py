@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from kobo.apps.hook.constants import (
+    HOOK_LOG_FAILED,
+    HOOK_LOG_PENDING,
+    HOOK_LOG_SUCCESS,
+)
+
+
+def populate_counts(apps, schema_editor):
+    Hook = apps.get_model('hook', 'Hook')
+    HookLog = apps.get_model('hook', 'HookLog')
+    count_fields = {
+        HOOK_LOG_SUCCESS: 'success_count',
+        HOOK_LOG_FAILED: 'failed_count',
+        HOOK_LOG_PENDING: 'pending_count',
+    }
+    counts = {}
+    queryset = HookLog.objects.values('hook_id', 'status').annotate(
+        values_count=models.Count('status')).order_by()
+    for record in queryset:
+        counts.setdefault(record['hook_id'], {})[
+            count_fields[record['status']]] = record['values_count']
+    for hook_id, hook_counts in counts.items():
+        Hook.objects.filter(pk=hook_id).update(**hook_counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hook', '0004_add_batch_delivery_to_hook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hook',
+            name='failed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='hook',
+            name='pending_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='hook',
+            name='success_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(
+            populate_counts,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
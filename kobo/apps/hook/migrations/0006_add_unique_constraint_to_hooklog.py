@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from kobo.apps.hook.constants import (
+    HOOK_LOG_FAILED,
+    HOOK_LOG_PENDING,
+    HOOK_LOG_SUCCESS,
+)
+
+
+def remove_duplicate_logs(apps, schema_editor):
+    """
+    Keep only the latest log of each hook and instance
+    """
+    Hook = apps.get_model('hook', 'Hook')
+    HookLog = apps.get_model('hook', 'HookLog')
+    duplicates = HookLog.objects.values('hook_id', 'instance_id').annotate(
+        logs_count=models.Count('id'), latest_id=models.Max('id')
+    ).filter(logs_count__gt=1).order_by()
+
+    hooks_ids = set()
+    for duplicate in duplicates:
+        HookLog.objects.filter(
+            hook_id=duplicate['hook_id'],
+            instance_id=duplicate['instance_id'],
+        ).exclude(id=duplicate['latest_id']).delete()
+        hooks_ids.add(duplicate['hook_id'])
+
+    # Count logs of hooks which lost some again
+    count_fields = {
+        HOOK_LOG_SUCCESS: 'success_count',
+        HOOK_LOG_FAILED: 'failed_count',
+        HOOK_LOG_PENDING: 'pending_count',
+    }
+    for hook_id in hooks_ids:
+        counts = dict((field, 0) for field in count_fields.values())
+        queryset = HookLog.objects.filter(hook_id=hook_id).values(
+            'status').annotate(values_count=models.Count('status')).order_by()
+        for record in queryset:
+            counts[count_fields[record['status']]] = record['values_count']
+        Hook.objects.filter(pk=hook_id).update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hook', '0005_add_log_counts_to_hook'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_logs,
+            reverse_code=migrations.RunPython.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='hooklog',
+            unique_together=set([('hook', 'instance_id')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hook', '0006_add_unique_constraint_to_hooklog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hook',
+            name='batch_scheduled_at',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+    ]
@@ -2,7 +2,7 @@
 from importlib import import_module
 
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from jsonbfield.fields import JSONField as JSONBField
 
@@ -47,17 +47,39 @@ class Hook(models.Model):
         models.CharField(max_length=500, blank=False),
         default=[],
     )
+    # Group submissions and send them from one task, see `HookUtils.call_services()`
+    batch_delivery = models.BooleanField(default=False)
+    # Set while a batch delivery is scheduled, see `HookUtils.schedule_batch_delivery()`
+    batch_scheduled_at = models.DateTimeField(null=True, blank=True)
+    # Number of logs per status, kept up to date by `HookLog`.
+    # See `update_counts()`
+    success_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0)
+
+    # Counter of each log status
+    COUNT_FIELDS = {
+        HOOK_LOG_SUCCESS: "success_count",
+        HOOK_LOG_FAILED: "failed_count",
+        HOOK_LOG_PENDING: "pending_count",
+    }
 
     class Meta:
         ordering = ["name"]
 
-    def __init__(self, *args, **kwargs):
-        self.__totals = {}
-        return super(Hook, self).__init__(*args, **kwargs)
-
     def save(self, *args, **kwargs):
         # Update date_modified each time object is saved
         self.date_modified = timezone.now()
+        # Counters are only changed by `update_counts()` and the batch
+        # delivery marker by `HookUtils.schedule_batch_delivery()`.
+        # Do not overwrite them with the values loaded with this instance
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.COUNT_FIELDS.values() and
+                field.name != "batch_scheduled_at"
+            ]
         super(Hook, self).save(*args, **kwargs)
 
     def __unicode__(self):
@@ -67,38 +89,49 @@ class Hook(models.Model):
         mod = import_module("kobo.apps.hook.services.service_{}".format(self.export_type))
         return getattr(mod, "ServiceDefinition")
 
-    @property
-    def success_count(self):
-        if not self.__totals:
-            self._get_totals()
-        return self.__totals.get(HOOK_LOG_SUCCESS)
-
-    @property
-    def failed_count(self):
-        if not self.__totals:
-            self._get_totals()
-        return self.__totals.get(HOOK_LOG_FAILED)
-
-    @property
-    def pending_count(self):
-        if not self.__totals:
-            self._get_totals()
-        return self.__totals.get(HOOK_LOG_PENDING)
-
-    def _get_totals(self):
-        # TODO add some cache
-        queryset = self.logs.values("status").annotate(values_count=models.Count("status"))
-        queryset.query.clear_ordering(True)
-
-        # Initialize totals
-        self.__totals = {
-            HOOK_LOG_SUCCESS: 0,
-            HOOK_LOG_FAILED: 0,
-            HOOK_LOG_PENDING: 0
-        }
-        for record in queryset:
-            self.__totals[record.get("status")] = record.get("values_count")
-
-    def reset_totals(self):
-        # TODO remove cache when it's enabled
-        self.__totals = {}
\ No newline at end of file
+    @classmethod
+    def update_counts(cls, hook_id, changes):
+        """
+        Adds `changes` to the counters of logs per status of a hook.
+        Counters are updated in the database with F expressions, so that
+        concurrent updates are not lost.
+        Must be called in the transaction which changes the logs.
+
+        :param hook_id: int. Hook PK
+        :param changes: dict. Number of logs to add to (or remove from)
+            the counter of each status
+        """
+        updates = dict(
+            (cls.COUNT_FIELDS[status], models.F(cls.COUNT_FIELDS[status]) + change)
+            for status, change in changes.items() if change
+        )
+        if updates:
+            cls.objects.filter(pk=hook_id).update(**updates)
+
+    def reconcile_counts(self):
+        """
+        Counts logs per status and fixes the counters of the hook if they
+        do not match.
+
+        :return: bool. Whether the counters were fixed
+        """
+        with transaction.atomic():
+            # Lock the hook first: logs changed from now on update counters
+            # after they are fixed, and are not counted below
+            counts = Hook.objects.select_for_update().filter(pk=self.pk)\
+                .values(*self.COUNT_FIELDS.values()).first()
+            if counts is None:
+                return False
+
+            actual_counts = dict((field, 0) for field in self.COUNT_FIELDS.values())
+            queryset = self.logs.values("status").annotate(values_count=models.Count("status"))
+            queryset.query.clear_ordering(True)
+            for record in queryset:
+                actual_counts[self.COUNT_FIELDS[record.get("status")]] = record.get("values_count")
+
+            for field, count in actual_counts.items():
+                setattr(self, field, count)
+            if actual_counts == counts:
+                return False
+            Hook.objects.filter(pk=self.pk).update(**actual_counts)
+        return True
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
 from importlib import import_module
 
 import constance
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 from jsonbfield.fields import JSONField as JSONBField
@@ -12,6 +13,7 @@ from rest_framework import status
 from rest_framework.reverse import reverse
 
 from ..constants import HOOK_LOG_PENDING, HOOK_LOG_FAILED, HOOK_LOG_SUCCESS, KOBO_INTERNAL_ERROR_STATUS_CODE
+from .hook import Hook
 from kpi.fields import KpiUidField
 from kpi.utils.log import logging
 
@@ -30,6 +32,7 @@ class HookLog(models.Model):
 
     class Meta:
         ordering = ["-date_created"]
+        unique_together = (("hook", "instance_id"),)
 
     def can_retry(self):
         """
@@ -105,8 +108,60 @@ class HookLog(models.Model):
         # We don't want to alter tries when we only change the status
         if kwargs.pop("reset_status", False) is False:
             self.tries += 1
-            self.hook.reset_totals()
-        super(HookLog, self).save(*args, **kwargs)
+
+        with transaction.atomic():
+            previous_status = None
+            if self.pk is not None:
+                previous_status = HookLog.objects.select_for_update().filter(
+                    pk=self.pk).values_list("status", flat=True).first()
+            super(HookLog, self).save(*args, **kwargs)
+            if previous_status != self.status:
+                changes = Counter({self.status: 1})
+                if previous_status is not None:
+                    changes[previous_status] -= 1
+                Hook.update_counts(self.hook_id, changes)
+
+    @staticmethod
+    def bulk_create_logs(logs):
+        """
+        Inserts `logs` with one query, like `QuerySet.bulk_create()`, and
+        updates the counters of their hooks.
+        `HookLog.save()` is not called.
+
+        :param logs: list. HookLog objects
+        """
+        changes = defaultdict(Counter)
+        for log in logs:
+            changes[log.hook_id][log.status] += 1
+        with transaction.atomic():
+            HookLog.objects.bulk_create(logs)
+            for hook_id, hook_changes in changes.items():
+                Hook.update_counts(hook_id, hook_changes)
+
+    @staticmethod
+    def bulk_update_logs(queryset, **fields):
+        """
+        Updates the logs of `queryset` with one query, like
+        `QuerySet.update()`, and the counters of their hooks if `status`
+        changes.
+
+        :param queryset: QuerySet. HookLogs
+        :param fields: dict. Values of the fields to update
+        :return: int. Number of updated logs
+        """
+        with transaction.atomic():
+            previous_statuses = Counter()
+            if "status" in fields:
+                previous_statuses.update(
+                    queryset.select_for_update().values_list("hook_id", "status"))
+            updated = queryset.update(**fields)
+            changes = defaultdict(Counter)
+            for (hook_id, status), count in previous_statuses.items():
+                changes[hook_id][status] -= count
+                changes[hook_id][fields["status"]] += count
+            for hook_id, hook_changes in changes.items():
+                Hook.update_counts(hook_id, hook_changes)
+        return updated
 
     @property
     def status_str(self):
@@ -2,11 +2,18 @@
 from __future__ import absolute_import
 
 from abc import ABCMeta, abstractmethod
+from collections import defaultdict
 import json
+from multiprocessing.pool import ThreadPool
 import os
 import re
+import threading
+import time
+from urlparse import urlparse
 
 import constance
+from django.conf import settings
+from django.utils import timezone
 import requests
 from rest_framework import status
 
@@ -15,22 +22,86 @@ from .hook import Hook
 from .hook_log import HookLog
 from kpi.utils.log import logging
 
+# `requests.Session`s keep their connections open. One is shared by all the
+# hooks of a worker process sending data to the same endpoint
+_sessions = {}
+_sessions_lock = threading.Lock()
+# Rate limiters are shared by all the hooks of a worker process sending data
+# to the same host
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _get_session(endpoint):
+    with _sessions_lock:
+        if endpoint not in _sessions:
+            session = requests.Session()
+            # Keep a connection open for each concurrent request
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=max(settings.HOOK_RETRY_CONCURRENCY,
+                                 requests.adapters.DEFAULT_POOLSIZE))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[endpoint] = session
+        return _sessions[endpoint]
+
+
+class _RateLimiter(object):
+    """
+    Spaces out requests made by several threads so that no more than `rate`
+    of them start per second
+    """
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._next_request_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            delay = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _get_rate_limiter(endpoint, rate):
+    host = urlparse(endpoint).netloc
+    with _rate_limiters_lock:
+        if (host, rate) not in _rate_limiters:
+            _rate_limiters[(host, rate)] = _RateLimiter(rate)
+        return _rate_limiters[(host, rate)]
+
+
+def _percentile(sorted_values, percent):
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
 
 class ServiceDefinitionInterface(object):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, hook, instance_id):
+    def __init__(self, hook, instance_id, submission=None, session=None):
+        """
+        :param hook: Hook.
+        :param instance_id: int. Instance PK
+        :param submission: json|xml. Optional. Retrieved from the deployment
+            backend if not provided
+        :param session: requests.Session. Optional. Used to send data
+        """
         self._hook = hook
         self._instance_id = instance_id
-        self._data = self._get_data()
+        self._session = session or requests
+        self._data = self._get_data(submission)
 
-    def _get_data(self):
+    def _get_data(self, submission=None):
         """
         Retrieves data from deployment backend of the asset.
         """
         try:
-            submission = self._hook.asset.deployment.get_submission(self._instance_id, self._hook.export_type)
+            if submission is None:
+                submission = self._hook.asset.deployment.get_submission(self._instance_id, self._hook.export_type)
             return self._parse_data(submission, self._hook.subset_fields)
         except Exception as e:
             logging.error("service_json.ServiceDefinition._get_data - Hook #{} - Data #{} - {}".format(
@@ -49,6 +120,28 @@ class ServiceDefinitionInterface(object):
             pass
         return submission
 
+    def _compile_subset_fields(self, fields):
+        """
+        Prepares `self._hook.subset_fields` for `_parse_data`.
+        :param fields: list
+        :return: mixed
+        """
+        return fields
+
+    def _get_compiled_subset_fields(self, fields):
+        """
+        Returns `fields` prepared by `_compile_subset_fields`, which are kept
+        on the hook until its `subset_fields` change.
+        :param fields: list
+        :return: mixed
+        """
+        key = (self.id, tuple(fields))
+        compiled_fields = getattr(self._hook, "_compiled_subset_fields", None)
+        if compiled_fields is None or compiled_fields[0] != key:
+            compiled_fields = (key, self._compile_subset_fields(fields))
+            self._hook._compiled_subset_fields = compiled_fields
+        return compiled_fields[1]
+
     @abstractmethod
     def _prepare_request_kwargs(self):
         """
@@ -64,12 +157,135 @@ class ServiceDefinitionInterface(object):
         """
         pass
 
+    @classmethod
+    def send_batch(cls, hook, instances_ids, concurrency=1, rate_limit=None,
+                   claimed=False):
+        """
+        Sends data of several instances to external endpoint, one request
+        per instance through the same pool of connections.
+        Submissions are retrieved with one query and logs are written
+        in bulk. The number of requests per second and their latency
+        are logged.
+
+        :param hook: Hook.
+        :param instances_ids: list. Instances PKs
+        :param concurrency: int. Maximum number of simultaneous requests
+        :param rate_limit: float. Optional. Maximum number of requests
+            per second to the host of the endpoint
+        :param claimed: bool. Whether the try has already been counted in
+            the logs, see `batch_service_definition_task`
+        :return: list. PKs of instances sent successfully
+        """
+        try:
+            submissions = hook.asset.deployment.get_submissions_by_id(
+                instances_ids, hook.export_type)
+        except Exception as e:
+            logging.error("ServiceDefinitionInterface.send_batch - Hook #{} - {}".format(
+                hook.uid, str(e)), exc_info=True)
+            submissions = {}
+
+        logs = dict((log.instance_id, log)
+                    for log in HookLog.objects.filter(hook=hook, instance_id__in=instances_ids))
+        session = _get_session(hook.endpoint)
+        # Missing submissions are logged as "No data available" instead
+        # of being retrieved again one by one
+        service_definitions = [
+            cls(hook, instance_id, submission=submissions.get(instance_id, ""),
+                session=session)
+            for instance_id in instances_ids
+        ]
+        rate_limiter = _get_rate_limiter(hook.endpoint, rate_limit) if rate_limit else None
+
+        def post(service_definition):
+            if rate_limiter:
+                rate_limiter.wait()
+            start = time.time()
+            result = service_definition._post()
+            return result, time.time() - start
+
+        start = time.time()
+        if concurrency > 1 and len(service_definitions) > 1:
+            pool = ThreadPool(min(concurrency, len(service_definitions)))
+            try:
+                results = pool.map(post, service_definitions)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [post(service_definition)
+                       for service_definition in service_definitions]
+        cls._log_metrics(hook, [latency for _, latency in results],
+                         time.time() - start)
+
+        sent_instances_ids = []
+        new_logs = []
+        updated_logs = defaultdict(list)
+
+        for service_definition, ((success, status_code, message), _) in zip(
+                service_definitions, results):
+            instance_id = service_definition._instance_id
+            if success:
+                sent_instances_ids.append(instance_id)
+
+            log = logs.get(instance_id)
+            if log is None:
+                log = HookLog(hook=hook, instance_id=instance_id)
+                new_logs.append(log)
+            elif claimed:
+                log.tries -= 1
+            service_definition._update_log(log, status_code, message, success)
+            log.tries += 1
+            if log.pk is not None:
+                updated_logs[(log.status, log.status_code, log.message, log.tries)].append(log.pk)
+
+        # `HookLog.save()` is bypassed, its fields are set by `_update_log()`
+        if new_logs:
+            HookLog.bulk_create_logs(new_logs)
+        # Logs with the same outcome, e.g. successes, are updated together
+        now = timezone.now()
+        for (status_, status_code, message, tries), pks in updated_logs.items():
+            HookLog.bulk_update_logs(
+                HookLog.objects.filter(pk__in=pks),
+                status=status_, status_code=status_code, message=message,
+                tries=tries, date_modified=now)
+
+        return sent_instances_ids
+
+    @staticmethod
+    def _log_metrics(hook, latencies, duration):
+        """
+        Logs the throughput and the distribution of the latency of requests
+        sent to the endpoint of `hook`
+
+        :param hook: Hook.
+        :param latencies: list. Seconds each request took
+        :param duration: float. Seconds all requests took
+        """
+        if not latencies:
+            return
+        latencies = sorted(latencies)
+        logging.info(
+            "ServiceDefinitionInterface.send_batch - Hook #{} - {} requests in {:.2f}s "
+            "({:.1f}/s) - latency p50={:.3f}s p90={:.3f}s p99={:.3f}s max={:.3f}s".format(
+                hook.uid, len(latencies), duration,
+                len(latencies) / duration if duration else float(len(latencies)),
+                _percentile(latencies, 50), _percentile(latencies, 90),
+                _percentile(latencies, 99), latencies[-1]))
+
     def send(self):
         """
         Sends data to external endpoint
         :return: bool
         """
+        success, status_code, message = self._post()
+        self.save_log(status_code, message, success)
+        return success
 
+    def _post(self):
+        """
+        Posts data to external endpoint
+        :return: tuple. (success, status code, message)
+        """
         success = False
         response = None  # Need to declare response before requests.post assignment in case of RequestException
         if self._data:
@@ -95,9 +311,12 @@ class ServiceDefinitionInterface(object):
                         "auth": (self._hook.settings.get("username"),
                                  self._hook.settings.get("password"))
                     })
-                response = requests.post(self._hook.endpoint, timeout=30, **request_kwargs)
+                response = self._session.post(self._hook.endpoint,
+                                              timeout=settings.HOOK_REQUEST_TIMEOUT,
+                                              **request_kwargs)
                 response.raise_for_status()
-                self.save_log(response.status_code, response.text, True)
+                status_code = response.status_code
+                text = response.text
                 success = True
             except requests.exceptions.RequestException as e:
                 # If request fails to communicate with remote server. Exception is raised before
@@ -107,20 +326,17 @@ class ServiceDefinitionInterface(object):
                 if response is not None:
                     text = response.text
                     status_code = response.status_code
-                self.save_log(status_code, text)
 
             except Exception as e:
                 logging.error("service_json.ServiceDefinition.send - Hook #{} - Data #{} - {}".format(
                     self._hook.uid, self._instance_id, str(e)), exc_info=True)
-                self.save_log(
-                    KOBO_INTERNAL_ERROR_STATUS_CODE,
-                    "An error occurred when sending data to external endpoint")
+                status_code = KOBO_INTERNAL_ERROR_STATUS_CODE
+                text = "An error occurred when sending data to external endpoint"
         else:
-            self.save_log(
-                KOBO_INTERNAL_ERROR_STATUS_CODE,
-                "No data available")
+            status_code = KOBO_INTERNAL_ERROR_STATUS_CODE
+            text = "No data available"
 
-        return success
+        return success, status_code, text
 
     def save_log(self, status_code, message, success=False):
         """
@@ -142,6 +358,24 @@ class ServiceDefinitionInterface(object):
         except HookLog.DoesNotExist:
             log = HookLog(**fields)
 
+        self._update_log(log, status_code, message, success)
+
+        try:
+            log.save()
+        except Exception as e:
+            logging.error("ServiceDefinitionInterface.save_log - {}".format(str(e)), exc_info=True)
+
+    def _update_log(self, log, status_code, message, success=False):
+        """
+        Sets the fields of a log entry after a try, without saving it.
+        `tries` and `date_modified` are left to `HookLog.save()` unless
+        `log` is saved in bulk.
+
+        :param log: HookLog.
+        :param status_code: int. HTTP status code
+        :param message: str.
+        :param success: bool.
+        """
         if success:
             log.status = HOOK_LOG_SUCCESS
         elif log.tries >= constance.config.HOOK_MAX_RETRIES:
@@ -157,8 +391,3 @@ class ServiceDefinitionInterface(object):
             message = re.sub(r"<[^>]*>", " ", message).strip()
 
         log.message = message
-
-        try:
-            log.save()
-        except Exception as e:
-            logging.error("ServiceDefinitionInterface.save_log - {}".format(str(e)), exc_info=True)
@@ -15,7 +15,8 @@ class HookSerializer(serializers.ModelSerializer):
         model = Hook
         fields = ("url", "logs_url", "asset", "uid", "name", "endpoint", "active", "export_type",
                   "auth_level", "success_count", "failed_count", "pending_count", "settings",
-                  "date_modified", "email_notification", "subset_fields")
+                  "date_modified", "email_notification", "subset_fields",
+                  "batch_delivery")
 
         read_only_fields = ("asset", "uid", "date_modified", "success_count", "failed_count", "pending_count")
 
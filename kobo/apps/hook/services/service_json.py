@@ -2,7 +2,6 @@
 from __future__ import absolute_import
 
 import json
-import re
 
 from ..models.service_definition_interface import ServiceDefinitionInterface
 
@@ -10,18 +9,24 @@ from ..models.service_definition_interface import ServiceDefinitionInterface
 class ServiceDefinition(ServiceDefinitionInterface):
     id = u"json"
 
+    def _compile_subset_fields(self, fields):
+        """
+        Splits fields into paths (e.g. `group/question`), which must equal
+        a key of the submission, and names, which must equal one of the
+        segments of a key.
+        """
+        paths = frozenset(field_ for field_ in fields if "/" in field_)
+        names = frozenset(field_ for field_ in fields if "/" not in field_)
+        return paths, names
+
     def _parse_data(self, submission, fields):
         if len(fields) > 0:
+            paths, names = self._get_compiled_subset_fields(fields)
             parsed_submission = {}
-            submission_keys = submission.keys()
-
-            for field_ in fields:
-                pattern = r"^{}$" if "/" in field_ else r"(^|/){}(/|$)"
-                for key_ in submission_keys:
-                    if re.search(pattern.format(field_), key_):
-                        parsed_submission.update({
-                            key_: submission[key_]
-                        })
+
+            for key_, value_ in submission.items():
+                if key_ in paths or not names.isdisjoint(key_.split("/")):
+                    parsed_submission[key_] = value_
 
             return parsed_submission
 
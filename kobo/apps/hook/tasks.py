@@ -1,18 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
-import time
+from collections import defaultdict, OrderedDict
 
 from celery import shared_task
 import constance
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Count
 from django.template import Context
 from django.template.loader import get_template
 from django.utils import translation, timezone
 from django_celery_beat.models import PeriodicTask
 
-from .constants import HOOK_LOG_FAILED
+from .constants import HOOK_LOG_FAILED, HOOK_LOG_PENDING
 from .models import Hook, HookLog
 from kpi.utils.log import logging
 
@@ -45,15 +48,87 @@ def service_definition_task(self, hook_id, instance_id):
     return True
 
 
+@shared_task
+def batch_service_definition_task(hook_id):
+    """
+    Sends data of all instances queued for the hook by
+    `HookUtils.call_services()`, `settings.HOOK_BATCH_SIZE` at a time.
+    Each batch is claimed first, so that instances are sent only once
+    even if several tasks run for the hook.
+    Instances which fail are retried individually by
+    `service_definition_task`, as if they had been sent by it.
+
+    :param hook_id: int. Hook PK
+    """
+    # Instances queued from now on are sent by the next batch
+    Hook.objects.filter(pk=hook_id).update(batch_scheduled_at=None)
+
+    hook = Hook.objects.get(id=hook_id)
+    ServiceDefinition = hook.get_service_definition()
+    # Logs of instances never sent
+    queued_logs = hook.logs.filter(status=HOOK_LOG_PENDING, tries=0).order_by("id")
+    while True:
+        logs_ids = list(queued_logs.values_list("id", flat=True)[:settings.HOOK_BATCH_SIZE])
+        if not logs_ids:
+            break
+
+        instances_ids = _claim_logs(logs_ids)
+        if not instances_ids:
+            # Claimed by another task meanwhile
+            continue
+
+        sent_instances_ids = set(ServiceDefinition.send_batch(
+            hook, instances_ids, claimed=True))
+        if constance.config.HOOK_MAX_RETRIES > 0:
+            for instance_id in instances_ids:
+                if instance_id not in sent_instances_ids:
+                    service_definition_task.apply_async(
+                        (hook_id, instance_id),
+                        countdown=HookLog.get_remaining_seconds(0),
+                        retries=1)
+
+    return True
+
+
+def _claim_logs(logs_ids):
+    """
+    Counts the first try of the logs which have never been tried, so that
+    no other task sends their instances.
+
+    :param logs_ids: list. HookLog PKs
+    :return: list. PKs of the instances of the claimed logs
+    """
+    with transaction.atomic():
+        # Rows claimed by a concurrent transaction are skipped once it commits
+        claimed_logs = list(HookLog.objects.select_for_update().filter(
+            id__in=logs_ids, status=HOOK_LOG_PENDING, tries=0,
+        ).order_by("id").values_list("id", "instance_id"))
+        HookLog.objects.filter(id__in=[id_ for id_, _ in claimed_logs]).update(tries=1)
+    return [instance_id for _, instance_id in claimed_logs]
+
+
 @shared_task
 def retry_all_task(hooklogs_ids):
     """
+    Retries to send data of the logs, hook by hook, with at most
+    `settings.HOOK_RETRY_CONCURRENCY` simultaneous requests and
+    `settings.HOOK_RETRY_RATE_LIMIT` requests per second to each host.
+
     :param list: <int>.
     """
-    hook_logs = HookLog.objects.filter(id__in=hooklogs_ids)
-    for hook_log in hook_logs:
-        hook_log.retry()
-        time.sleep(0.2)
+    instances_ids_by_hook = defaultdict(list)
+    for hook_id, instance_id in HookLog.objects.filter(id__in=hooklogs_ids)\
+            .order_by("id").values_list("hook_id", "instance_id"):
+        instances_ids_by_hook[hook_id].append(instance_id)
+
+    for hook in Hook.objects.filter(id__in=instances_ids_by_hook.keys()):
+        ServiceDefinition = hook.get_service_definition()
+        instances_ids = instances_ids_by_hook[hook.id]
+        for index in range(0, len(instances_ids), settings.HOOK_BATCH_SIZE):
+            ServiceDefinition.send_batch(
+                hook, instances_ids[index:index + settings.HOOK_BATCH_SIZE],
+                concurrency=settings.HOOK_RETRY_CONCURRENCY,
+                rate_limit=settings.HOOK_RETRY_RATE_LIMIT)
 
     return True
 
@@ -70,12 +145,11 @@ def failures_reports():
         .order_by("-last_run_at").first()
 
     if failures_reports_period_task:
-        
+
         last_run_at = failures_reports_period_task.last_run_at
         queryset = HookLog.objects.filter(hook__email_notification=True, status=HOOK_LOG_FAILED)
         if last_run_at:
             queryset = queryset.filter(date_modified__gte=last_run_at)
-        queryset = queryset.order_by("hook__asset__name", "hook__uid", "-date_modified")
 
         # PeriodicTask are updated every 3 minutes (default).
         # It means, if this task interval is less than 3 minutes, some data can be duplicated in emails.
@@ -84,74 +158,91 @@ def failures_reports():
         # see: http://docs.celeryproject.org/en/latest/userguide/configuration.html#beat-sync-every
         PeriodicTask.objects.filter(task=beat_schedule.get("task")).update(last_run_at=timezone.now())
 
-        records = {}
-        max_length = 0
+        # Count failures of each hook with one query. Only the latest logs of
+        # each hook are retrieved afterwards
+        hooks_failures = queryset.values(
+            "hook_id", "hook__uid", "hook__name", "hook__asset_id",
+            "hook__asset__name", "hook__asset__owner_id"
+        ).annotate(failures_count=Count("id")).order_by()
+        hooks_failures_by_owner = defaultdict(list)
+        for hook_failures in hooks_failures:
+            hooks_failures_by_owner[hook_failures["hook__asset__owner_id"]].append(hook_failures)
+
+        owners_ids = sorted(hooks_failures_by_owner.keys())
+        chunk_size = settings.HOOK_FAILURES_REPORT_CHUNK_SIZE
+        try:
+            # Send all email messages through the same connection
+            with get_connection() as connection:
+                for index in range(0, len(owners_ids), chunk_size):
+                    email_messages = _get_failures_reports_messages(
+                        queryset,
+                        owners_ids[index:index + chunk_size],
+                        hooks_failures_by_owner)
+                    if len(email_messages) > 0:
+                        connection.send_messages(email_messages)
+        except Exception as e:
+            logging.error("failures_reports - {}".format(str(e)), exc_info=True)
+            return False
+
+    return True
 
+
+def _get_failures_reports_messages(queryset, owners_ids, hooks_failures_by_owner):
+    """
+    Renders the failures reports of several owners
+
+    :param queryset: QuerySet. Failed logs to report
+    :param owners_ids: list. Users PKs
+    :param hooks_failures_by_owner: dict. Failures count and names of each
+        hook with failures, per owner
+    :return: list. EmailMultiAlternatives
+    """
+    plain_text_template = get_template("reports/failures_email_body.txt")
+    html_template = get_template("reports/failures_email_body.html")
+    max_logs = settings.HOOK_FAILURES_REPORT_MAX_LOGS
+    email_messages = []
+
+    owners = User.objects.filter(id__in=owners_ids).only("id", "username", "email")
+    for owner in owners:
         # Prepare data for templates.
-        # All logs will be grouped under their respective asset and user.
-        for record in queryset:
-            # if users don't exist in dict, add them
-            if record.hook.asset.owner.id not in records:
-                records[record.hook.asset.owner.id] = {
-                    "username": record.hook.asset.owner.username,
-                    # language is not implemented yet.
-                    # TODO add language to user table in registration process
-                    "language": getattr(record.hook.asset.owner, "language", "en"),
-                    "email": record.hook.asset.owner.email,
-                    "assets": {}
-                }
-
-            # if asset doesn't exist in user's asset dict, add it
-            if record.hook.asset.id not in records[record.hook.asset.owner.id]["assets"]:
-                max_length = 0
-                records[record.hook.asset.owner.id]["assets"][record.hook.asset.id] = {
-                    "name": record.hook.asset.name,
-                    "max_length": 0,
-                    "logs": []
-                }
-
-            # Add log to corresponding asset and user
-            records[record.hook.asset.owner.id]["assets"][record.hook.asset.id]["logs"].append({
-                "hook_name": record.hook.name,
-                "uid": record.uid,
-                "date_modified": record.date_modified,
-                "status_code": record.status_code,
-                "message": record.message
+        # All logs are grouped under their respective asset.
+        assets = OrderedDict()
+        hooks_failures = sorted(hooks_failures_by_owner[owner.id],
+                                key=lambda hook_failures: (hook_failures["hook__asset__name"],
+                                                           hook_failures["hook__uid"]))
+        for hook_failures in hooks_failures:
+            asset = assets.setdefault(hook_failures["hook__asset_id"], {
+                "name": hook_failures["hook__asset__name"],
+                # Max Length is used for plain text template. To display fixed size columns.
+                "max_length": 0,
+                "logs": [],
+                "hidden_logs_count": 0
             })
-            hook_name_length = len(record.hook.name)
-
-            # Max Length is used for plain text template. To display fixed size columns.
-            max_length = max(max_length, hook_name_length)
-            records[record.hook.asset.owner.id]["assets"][record.hook.asset.id]["max_length"] = max_length
-
-        # Get templates
-        plain_text_template = get_template("reports/failures_email_body.txt")
-        html_template = get_template("reports/failures_email_body.html")
-        email_messages = []
-
-        for owner_id, record in records.items():
-            variables = {
-                "username": record.get("username"),
-                "assets": record.get("assets")
-            }
-            # Localize templates
-            translation.activate(record.get("language"))
+            hook_name = hook_failures["hook__name"]
+            asset["max_length"] = max(asset["max_length"], len(hook_name))
+            logs = queryset.filter(hook_id=hook_failures["hook_id"]).order_by("-date_modified")\
+                .values("uid", "date_modified", "status_code", "message")[:max_logs]
+            for log in logs:
+                log["hook_name"] = hook_name
+                asset["logs"].append(log)
+            asset["hidden_logs_count"] += max(hook_failures["failures_count"] - max_logs, 0)
+
+        variables = {
+            "username": owner.username,
+            "assets": assets
+        }
+        # Localize templates
+        # language is not implemented yet.
+        # TODO add language to user table in registration process
+        with translation.override(getattr(owner, "language", "en")):
             text_content = plain_text_template.render(Context(variables))
             html_content = html_template.render(Context(variables))
+            subject = translation.ugettext("REST Services Failure Report")
 
-            msg = EmailMultiAlternatives(translation.ugettext("REST Services Failure Report"), text_content,
-                                         constance.config.SUPPORT_EMAIL,
-                                         [record.get("email")])
-            msg.attach_alternative(html_content, "text/html")
-            email_messages.append(msg)
-
-        # Send email messages
-        if len(email_messages) > 0:
-            try:
-                with get_connection() as connection:
-                    connection.send_messages(email_messages)
-            except Exception as e:
-                logging.error("failures_reports - {}".format(str(e)), exc_info=True)
-                return False
+        msg = EmailMultiAlternatives(subject, text_content,
+                                     constance.config.SUPPORT_EMAIL,
+                                     [owner.email])
+        msg.attach_alternative(html_content, "text/html")
+        email_messages.append(msg)
 
-    return True
+    return email_messages
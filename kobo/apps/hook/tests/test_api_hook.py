@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+from copy import deepcopy
 import json
 
 import constance
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError, transaction
+import mock
 import requests
 import responses
 from rest_framework import status
 
 from .hook_test_case import HookTestCase
+from ..constants import HOOK_LOG_PENDING, HOOK_LOG_SUCCESS
+from ..models import Hook, HookLog
+from ..tasks import batch_service_definition_task
+from ..utils import HookUtils
 from kpi.constants import INSTANCE_FORMAT_TYPE_JSON
 
 
@@ -74,6 +82,42 @@ class ApiHookTestCase(HookTestCase):
         response = self.client.post(submission_url, data)
         self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
 
+    @responses.activate
+    def test_bulk_data_submission(self):
+        hook = self._create_hook(settings={})
+        responses.add(responses.POST, hook.endpoint,
+                      status=status.HTTP_200_OK,
+                      content_type="application/json")
+        submission = self.asset.deployment.get_submissions()[0]
+        submissions = [submission]
+        for instance_id in range(submission["id"] + 1, submission["id"] + 3):
+            other_submission = deepcopy(submission)
+            other_submission["id"] = instance_id
+            submissions.append(other_submission)
+        self.asset.deployment.mock_submissions(submissions)
+        instances_ids = [submission["id"] for submission in submissions]
+        submission_url = reverse("submission-list", kwargs={"parent_lookup_asset": self.asset.uid})
+
+        data = {"instance_ids": instances_ids[:2]}
+        response = self.client.post(submission_url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        response = self.client.post(submission_url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        # Only the instance which was not sent yet is sent
+        data = {"instance_ids": instances_ids}
+        response = self.client.post(submission_url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(
+            sorted(hook.logs.values_list("instance_id", "status", "tries")),
+            [(instance_id, HOOK_LOG_SUCCESS, 1) for instance_id in instances_ids])
+
+        # Duplicates are rejected by the database
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                HookLog.objects.create(hook=hook, instance_id=instances_ids[0])
+
     def test_non_owner_cannot_access(self):
         hook = self._create_hook()
         self.client.logout()
@@ -156,6 +200,51 @@ class ApiHookTestCase(HookTestCase):
         response = self.client.get(detail_url, format=INSTANCE_FORMAT_TYPE_JSON)
         self.assertEqual(response.data.get("tries"), 2)
 
+    @responses.activate
+    def test_retry_all(self):
+        first_log_response = self._send_and_fail()
+
+        retry_url = reverse("hook-retry", kwargs={
+            "parent_lookup_asset": self.asset.uid,
+            "uid": self.hook.uid
+        })
+        response = self.client.patch(retry_url, format=INSTANCE_FORMAT_TYPE_JSON)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get("pending_uids"),
+                         [first_log_response.get("uid")])
+
+        log = HookLog.objects.get(uid=first_log_response.get("uid"))
+        self.assertEqual(log.status, HOOK_LOG_SUCCESS)
+        self.assertEqual(log.tries, 2)
+        self.hook.refresh_from_db()
+        self.assertEqual((self.hook.success_count, self.hook.failed_count,
+                          self.hook.pending_count), (1, 0, 0))
+
+    @responses.activate
+    def test_log_counts(self):
+        self._send_and_fail()
+        detail_url = reverse("hook-detail", kwargs={
+            "parent_lookup_asset": self.asset.uid,
+            "uid": self.hook.uid,
+        })
+        response = self.client.get(detail_url)
+        self.assertEqual(response.data.get("success_count"), 0)
+        self.assertEqual(response.data.get("failed_count"), 1)
+        self.assertEqual(response.data.get("pending_count"), 0)
+
+        # Saving a hook does not overwrite its counters
+        self.hook.name = "renamed external service"
+        self.hook.save()
+        self.hook.refresh_from_db()
+        self.assertEqual(self.hook.failed_count, 1)
+
+        # Counters which drifted are fixed
+        Hook.objects.filter(pk=self.hook.pk).update(success_count=5, failed_count=0)
+        call_command("reconcile_hook_log_counts", verbosity=0)
+        self.hook.refresh_from_db()
+        self.assertEqual((self.hook.success_count, self.hook.failed_count,
+                          self.hook.pending_count), (0, 1, 0))
+
     def test_validation(self):
 
         constance.config.ALLOW_UNSECURED_HOOK_ENDPOINTS = False
@@ -163,4 +252,71 @@ class ApiHookTestCase(HookTestCase):
         response = self._create_hook(return_response_only=True)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         expected_response = {"endpoint": ["Unsecured endpoint is not allowed"]}
-        self.assertEqual(response.data, expected_response)
\ No newline at end of file
+        self.assertEqual(response.data, expected_response)
+
+    @responses.activate
+    def test_batch_delivery(self):
+        hook = self._create_hook()
+        hook.batch_delivery = True
+        hook.save()
+        responses.add(responses.POST, hook.endpoint,
+                      status=status.HTTP_200_OK,
+                      content_type="application/json")
+
+        submission = self.asset.deployment.get_submissions()[0]
+        other_submission = deepcopy(submission)
+        other_submission["id"] = submission["id"] + 1
+        self.asset.deployment.mock_submissions([submission, other_submission])
+        instances_ids = [submission["id"], other_submission["id"]]
+
+        # Instances are queued and sent later by only one task
+        with mock.patch.object(batch_service_definition_task,
+                               "apply_async") as apply_async:
+            for instance_id in instances_ids:
+                self.assertTrue(HookUtils.call_services(self.asset, instance_id))
+        apply_async.assert_called_once_with((hook.id,), countdown=mock.ANY)
+        self.assertEqual(len(responses.calls), 0)
+        hook.refresh_from_db()
+        self.assertIsNotNone(hook.batch_scheduled_at)
+        logs = HookLog.objects.filter(hook=hook)
+        self.assertEqual(
+            sorted(logs.values_list("instance_id", "status", "tries")),
+            [(instance_id, HOOK_LOG_PENDING, 0) for instance_id in instances_ids])
+
+        get_submissions_by_id = mock.Mock(
+            wraps=self.asset.deployment.get_submissions_by_id)
+        with mock.patch("kpi.deployment_backends.mock_backend."
+                        "MockDeploymentBackend.get_submissions_by_id",
+                        get_submissions_by_id):
+            batch_service_definition_task(hook.id)
+        get_submissions_by_id.assert_called_once_with(
+            instances_ids, INSTANCE_FORMAT_TYPE_JSON)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(
+            sorted(logs.values_list("instance_id", "status", "tries")),
+            [(instance_id, HOOK_LOG_SUCCESS, 1) for instance_id in instances_ids])
+        hook.refresh_from_db()
+        self.assertIsNone(hook.batch_scheduled_at)
+        self.assertEqual(hook.success_count, 2)
+        self.assertEqual(hook.pending_count, 0)
+
+    @responses.activate
+    def test_batch_delivery_skips_claimed_logs(self):
+        hook = self._create_hook()
+        hook.batch_delivery = True
+        hook.save()
+        responses.add(responses.POST, hook.endpoint,
+                      status=status.HTTP_200_OK,
+                      content_type="application/json")
+
+        instance_id = self.asset.deployment.get_submissions()[0]["id"]
+        with mock.patch.object(batch_service_definition_task, "apply_async"):
+            self.assertTrue(HookUtils.call_services(self.asset, instance_id))
+
+        # Another task has claimed the log before this one
+        HookLog.objects.filter(hook=hook).update(tries=1)
+        batch_service_definition_task(hook.id)
+        self.assertEqual(len(responses.calls), 0)
+        self.assertEqual(
+            list(HookLog.objects.filter(hook=hook).values_list("status", "tries")),
+            [(HOOK_LOG_PENDING, 1)])
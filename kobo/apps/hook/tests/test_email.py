@@ -8,11 +8,14 @@ from django.core import mail
 from django_celery_beat.models import PeriodicTask
 from django.template import Context
 from django.template.loader import get_template
+from django.test import override_settings
 from django.utils import translation, dateparse
 import responses
 from rest_framework import status
 
 from .hook_test_case import HookTestCase
+from ..constants import HOOK_LOG_FAILED
+from ..models import HookLog
 from ..tasks import failures_reports
 from kpi.constants import INSTANCE_FORMAT_TYPE_JSON
 
@@ -64,3 +67,21 @@ class EmailTestCase(HookTestCase):
         text_content = plain_text_template.render(Context(variables))
 
         self.assertEqual(mail.outbox[0].body, text_content)
+
+    @responses.activate
+    @override_settings(HOOK_FAILURES_REPORT_MAX_LOGS=2)
+    def test_notifications_list_latest_failures(self):
+        self._create_periodisk_task()
+        first_log_response = self._send_and_fail()
+        logs = [HookLog.objects.create(hook=self.hook, instance_id=instance_id,
+                                       status=HOOK_LOG_FAILED)
+                for instance_id in range(100, 103)]
+        failures_reports.delay()
+        self.assertEqual(len(mail.outbox), 1)
+
+        body = mail.outbox[0].body
+        self.assertNotIn(first_log_response.get("uid"), body)
+        self.assertNotIn(logs[0].uid, body)
+        self.assertIn(logs[1].uid, body)
+        self.assertIn(logs[2].uid, body)
+        self.assertIn("... and 2 earlier failures", body)
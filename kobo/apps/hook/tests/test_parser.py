@@ -6,6 +6,7 @@ import json
 import re
 
 from .hook_test_case import HookTestCase
+from ..services.service_xml import ServiceDefinition as XMLServiceDefinition
 from kpi.constants import INSTANCE_FORMAT_TYPE_XML
 
 
@@ -27,6 +28,35 @@ class ParserTestCase(HookTestCase):
         }
         self.assertEquals(service_definition._get_data(), expected_data)
 
+    def test_json_parser_matches_whole_names(self):
+        hook = self._create_hook(subset_fields=["q1", "group.1/q2"])
+        ServiceDefinition = hook.get_service_definition()
+        service_definition = ServiceDefinition(hook, 0, submission={})
+        submission = {
+            "q1": "Value1",
+            "q10": "Value10",
+            "group/q1": "Value1 in group",
+            "q1/q3": "Value3 in q1",
+            "group.1/q2": "Value2",
+            "groupX1/q2": "Value2 in other group",
+        }
+        expected_data = {
+            "q1": "Value1",
+            "group/q1": "Value1 in group",
+            "q1/q3": "Value3 in q1",
+            "group.1/q2": "Value2",
+        }
+        self.assertEquals(service_definition._parse_data(submission, hook.subset_fields),
+                          expected_data)
+
+        # Subset fields are compiled once per hook, until they change
+        compiled_fields = service_definition._get_compiled_subset_fields(hook.subset_fields)
+        self.assertIs(service_definition._get_compiled_subset_fields(hook.subset_fields),
+                      compiled_fields)
+        hook.subset_fields = ["q10"]
+        self.assertEquals(service_definition._parse_data(submission, hook.subset_fields),
+                          {"q10": "Value10"})
+
     def test_xml_parser(self):
         self.asset_xml = self.create_asset(
             "some_asset_with_xml_submissions",
@@ -67,3 +97,17 @@ class ParserTestCase(HookTestCase):
 
         self.assertEquals(remove_whitespace(service_definition._get_data()),
                           remove_whitespace(expected_xml))
+
+    def test_xml_parser_matches_whole_tags(self):
+        xml = ("<root>"
+               "   <q1>Value1</q1>"
+               "   <q10>Value10</q10>"
+               "   <group><q1>Value1 in group</q1><q2>Value2</q2></group>"
+               "</root>")
+        expected_xml = ("<root>"
+                        "<q1>Value1</q1>"
+                        "<group><q1>Value1 in group</q1></group>"
+                        "</root>")
+        subset = XMLServiceDefinition._extract_subset(xml, frozenset(["q1"]))
+        self.assertEquals(re.sub(r">\s+<", "><", subset).strip(), expected_xml)
+        self.assertIsNone(XMLServiceDefinition._extract_subset(xml, frozenset(["q3"])))
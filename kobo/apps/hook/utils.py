@@ -1,8 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+from datetime import timedelta
+
+from celery import group
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from .models.hook import Hook
 from .models.hook_log import HookLog
-from .tasks import service_definition_task
+from .tasks import service_definition_task, batch_service_definition_task
 
 
 class HookUtils(object):
@@ -14,15 +23,90 @@ class HookUtils(object):
 
         :param asset: Asset.
         :param instance_id: int. Instance primary key
+        :return: bool. Whether data is sent to at least one hook
+        """
+        return len(HookUtils.call_services_in_bulk(asset, [instance_id])) > 0
+
+    @staticmethod
+    def call_services_in_bulk(asset, instances_ids):
         """
+        Delegates to Celery data submission of several instances to remote
+        servers.
+        A pending log is created for each active hook and instance which do
+        not have one yet. Data of an instance is sent once to each hook, the
+        unique constraint on logs rejects concurrent duplicate calls.
+
+        :param asset: Asset.
+        :param instances_ids: list. Instances primary keys
+        :return: list. Primary keys of instances sent to at least one hook
+        """
+        instances_ids = sorted(set(int(instance_id) for instance_id in instances_ids))
         # Retrieve `Hook` ids, to send data to their respective endpoint.
-        hooks_ids = asset.hooks.filter(active=True).values_list("id", flat=True).distinct()
-        # At least, one of the hooks must not have a log that corresponds to `instance_id`
-        # to make success equal True
-        success = False
-        for hook_id in hooks_ids:
-            if not HookLog.objects.filter(instance_id=instance_id, hook_id=hook_id).exists():
-                success = True
-                service_definition_task.delay(hook_id, instance_id)
-
-        return success
\ No newline at end of file
+        hooks = dict(asset.hooks.filter(active=True).values_list("id", "batch_delivery"))
+        if not hooks or not instances_ids:
+            return []
+
+        # Skip instances already sent to each hook, with one query
+        existing_logs = set(HookLog.objects.filter(
+            hook_id__in=hooks.keys(), instance_id__in=instances_ids
+        ).values_list("hook_id", "instance_id"))
+        logs = HookUtils._create_logs([
+            HookLog(hook_id=hook_id, instance_id=instance_id)
+            for hook_id in sorted(hooks.keys())
+            for instance_id in instances_ids
+            if (hook_id, instance_id) not in existing_logs
+        ])
+
+        signatures = []
+        batch_hooks_ids = set()
+        for log in logs:
+            if hooks[log.hook_id]:
+                batch_hooks_ids.add(log.hook_id)
+            else:
+                signatures.append(service_definition_task.s(log.hook_id, log.instance_id))
+        if signatures:
+            group(signatures).delay()
+        for hook_id in sorted(batch_hooks_ids):
+            HookUtils.schedule_batch_delivery(hook_id)
+
+        return sorted(set(log.instance_id for log in logs))
+
+    @staticmethod
+    def _create_logs(logs):
+        """
+        Inserts pending logs which have never been tried.
+        Logs created meanwhile by another call are skipped.
+
+        :param logs: list. HookLog objects
+        :return: list. Logs which were inserted
+        """
+        try:
+            HookLog.bulk_create_logs(logs)
+            return logs
+        except IntegrityError:
+            created_logs = []
+            for log in logs:
+                try:
+                    HookLog.bulk_create_logs([log])
+                    created_logs.append(log)
+                except IntegrityError:
+                    pass
+            return created_logs
+
+    @staticmethod
+    def schedule_batch_delivery(hook_id):
+        """
+        Delegates to Celery the delivery of the instances queued for a hook in
+        `settings.HOOK_BATCH_WINDOW` seconds, unless it is already scheduled.
+
+        :param hook_id: int. Hook primary key
+        """
+        countdown = settings.HOOK_BATCH_WINDOW
+        now = timezone.now()
+        # The marker expires on its own in case the task is lost
+        expired = now - timedelta(seconds=countdown + settings.CELERY_TASK_TIME_LIMIT)
+        # Only one of concurrent calls, from any process, sets the marker
+        if Hook.objects.filter(
+                Q(batch_scheduled_at__isnull=True) | Q(batch_scheduled_at__lt=expired),
+                pk=hook_id).update(batch_scheduled_at=now):
+            batch_service_definition_task.apply_async((hook_id,), countdown=countdown)
\ No newline at end of file
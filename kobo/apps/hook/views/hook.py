@@ -187,7 +187,8 @@ class HookViewSet(NestedViewSetMixin, viewsets.ModelViewSet):
 
             if len(records) > 0:
                 # Mark all logs as PENDING
-                HookLog.objects.filter(id__in=hooklogs_ids).update(status=HOOK_LOG_PENDING)
+                HookLog.bulk_update_logs(HookLog.objects.filter(id__in=hooklogs_ids),
+                                         status=HOOK_LOG_PENDING)
                 # Delegate to Celery
                 retry_all_task.delay(hooklogs_ids)
                 response.update({
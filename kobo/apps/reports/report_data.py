@@ -1,11 +1,17 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
+import cPickle
+import hashlib
 import itertools
-from collections import OrderedDict
+import json
+import threading
+from collections import Counter, OrderedDict, defaultdict
 from copy import deepcopy
 
 from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
 from django.utils.translation import ugettext as _
 from formpack import FormPack
 from rest_framework import serializers
@@ -14,19 +20,114 @@ from .constants import SPECIFIC_REPORTS_KEY, DEFAULT_REPORTS_KEY
 from kpi.utils.log import logging
 
 
-def build_formpack(asset, submission_stream=None, use_all_form_versions=True):
+FUZZY_VERSION_ID_KEY = '_version_'
+INFERRED_VERSION_ID_KEY = '__inferred_version__'
+# Keys that usually hold the version id of a submission. All of them contain
+# `FUZZY_VERSION_ID_KEY`
+WELL_KNOWN_VERSION_ID_KEYS = ('__version__', '_version_')
+# Questions whose statistics can be computed from the number of submissions
+# per distinct value, as counted by the deployment backend
+AGGREGATABLE_DATA_TYPES = ('select_one', 'select_multiple', 'integer',
+                           'decimal')
+
+# Pickled `FormPack`s, most recently used last, by `_formpack_cache_key()`
+_formpack_cache = OrderedDict()
+_formpack_cache_lock = threading.Lock()
+
+
+def _formpack_cache_key(asset_uid, use_all_form_versions):
+    return 'formpack:{}:{}'.format(
+        asset_uid, 'all' if use_all_form_versions else 'latest')
+
+
+def _get_shared_formpack_cache():
     '''
-    Return a tuple containing a `FormPack` instance and the iterable stream of
-    submissions for the given `asset`. If `use_all_form_versions` is `False`,
-    then only the newest version of the form is considered, and all submissions
-    are assumed to have been collected with that version of the form.
+    Return the cache `settings.FORMPACK_CACHE`, or `None` if it is local to
+    the process, since `_formpack_cache` already keeps `FormPack`s there
     '''
-    FUZZY_VERSION_ID_KEY = '_version_'
-    INFERRED_VERSION_ID_KEY = '__inferred_version__'
+    cache = caches[settings.FORMPACK_CACHE]
+    if isinstance(cache, LocMemCache):
+        return None
+    return cache
 
-    if not asset.has_deployment:
-        raise Exception('Cannot build formpack for asset without deployment')
 
+def _get_cached_formpack(cache_key, versions_key):
+    '''
+    Return the cached tuple of `FormPack`, newest-first version ids and
+    reversion ids stored under `cache_key`, or `None` if there is none or it
+    was built from other versions than those identified by `versions_key`.
+    Each call unpickles a new copy, so callers are free to modify it
+    '''
+    with _formpack_cache_lock:
+        entry = _formpack_cache.pop(cache_key, None)
+        if entry is not None:
+            _formpack_cache[cache_key] = entry
+    if entry is None:
+        shared_cache = _get_shared_formpack_cache()
+        if shared_cache is None:
+            return None
+        entry = shared_cache.get(cache_key)
+        if entry is None:
+            return None
+        _remember_formpack(cache_key, entry)
+    cached_versions_key, pickled = entry
+    if cached_versions_key != versions_key:
+        return None
+    return cPickle.loads(pickled)
+
+
+def _remember_formpack(cache_key, entry):
+    with _formpack_cache_lock:
+        _formpack_cache.pop(cache_key, None)
+        _formpack_cache[cache_key] = entry
+        while len(_formpack_cache) > settings.FORMPACK_CACHE_SIZE:
+            _formpack_cache.popitem(last=False)
+
+
+def _cache_formpack(cache_key, versions_key, built):
+    try:
+        pickled = cPickle.dumps(built, cPickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        logging.warning(
+            'Failed to pickle formpack: %s' % repr(e), exc_info=True)
+        return
+    entry = (versions_key, pickled)
+    _remember_formpack(cache_key, entry)
+    shared_cache = _get_shared_formpack_cache()
+    if shared_cache is not None:
+        shared_cache.set(cache_key, entry, settings.FORMPACK_CACHE_TIMEOUT)
+
+
+def invalidate_formpack_cache(asset_uid):
+    '''
+    Discard the cached `FormPack`s of the asset, e.g. after a deployment
+    '''
+    cache_keys = [
+        _formpack_cache_key(asset_uid, use_all_form_versions)
+        for use_all_form_versions in (True, False)
+    ]
+    with _formpack_cache_lock:
+        for cache_key in cache_keys:
+            _formpack_cache.pop(cache_key, None)
+    shared_cache = _get_shared_formpack_cache()
+    if shared_cache is not None:
+        shared_cache.delete_many(cache_keys)
+
+
+def _get_versions_key(asset, use_all_form_versions=True):
+    '''
+    Return a digest of the asset name and the ordered uids of the deployed
+    versions a `FormPack` of the asset is built from
+    '''
+    deployed_version_ids = asset.deployed_versions.values_list(
+        'uid', 'uid_aliases')
+    if not use_all_form_versions:
+        deployed_version_ids = deployed_version_ids[:1]
+    return hashlib.sha1(json.dumps(
+        [asset.name, list(deployed_version_ids)])).hexdigest()
+
+
+def _build_formpack(asset, use_all_form_versions):
     if use_all_form_versions:
         _versions = asset.deployed_versions
     else:
@@ -65,38 +166,93 @@ def build_formpack(asset, submission_stream=None, use_all_form_versions=True):
             for v in _versions if v._reversion_version_id
     ])
 
-    # A submission often contains many version keys, e.g. `__version__`,
-    # `_version_`, `_version__001`, `_version__002`, each with a different
-    # version id (see https://github.com/kobotoolbox/kpi/issues/1465). To cope,
-    # assume that the newest version of this asset whose id appears in the
-    # submission is the proper one to use
+    return pack, version_ids_newest_first, _reversion_ids
+
+
+def _build_version_id_resolver(version_ids_newest_first, reversion_ids):
+    '''
+    Return a function that stores the inferred version id of a submission
+    under `INFERRED_VERSION_ID_KEY` and returns the submission.
+
+    A submission often contains many version keys, e.g. `__version__`,
+    `_version_`, `_version__001`, `_version__002`, each with a different
+    version id (see https://github.com/kobotoolbox/kpi/issues/1465). To cope,
+    assume that the newest version of this asset whose id appears in the
+    submission is the proper one to use. Deprecated reversion ids count as
+    the `AssetVersion` they map to in `reversion_ids`. Fall back on the
+    newest version if none appears.
+    '''
+    # Rank every known id by the age of its version, 0 being the newest, so
+    # that resolving a submission takes one lookup per version key
+    ranks = {}
+    for rank, version_id in enumerate(version_ids_newest_first):
+        ranks.setdefault(version_id, rank)
+    for reversion_id, version_id in reversion_ids.iteritems():
+        if version_id in ranks:
+            ranks.setdefault(reversion_id, ranks[version_id])
+
+    def _rank(version_id):
+        try:
+            return ranks.get(version_id)
+        except TypeError:
+            # Unhashable, e.g. a repeating group whose name contains
+            # `FUZZY_VERSION_ID_KEY`
+            return None
+
     def _infer_version_id(submission):
-        if not use_all_form_versions:
+        best_rank = None
+        for key in WELL_KNOWN_VERSION_ID_KEYS:
+            rank = _rank(submission.get(key))
+            if rank is not None and (best_rank is None or rank < best_rank):
+                best_rank = rank
+        if best_rank != 0:
+            # Nothing newer than the newest version can be found; otherwise,
+            # the other version keys must be checked
+            for key, value in submission.iteritems():
+                if FUZZY_VERSION_ID_KEY not in key:
+                    continue
+                rank = _rank(value)
+                if rank is not None and (
+                        best_rank is None or rank < best_rank):
+                    best_rank = rank
+        submission[INFERRED_VERSION_ID_KEY] = version_ids_newest_first[
+            best_rank or 0]
+        return submission
+
+    return _infer_version_id
+
+
+def build_formpack(asset, submission_stream=None, use_all_form_versions=True):
+    '''
+    Return a tuple containing a `FormPack` instance and the iterable stream of
+    submissions for the given `asset`. If `use_all_form_versions` is `False`,
+    then only the newest version of the form is considered, and all submissions
+    are assumed to have been collected with that version of the form.
+
+    The `FormPack` is cached in memory and, unless it is local to the
+    process, in `settings.FORMPACK_CACHE`, along with the ordered uids of the
+    deployed versions it was built from.
+    '''
+    if not asset.has_deployment:
+        raise Exception('Cannot build formpack for asset without deployment')
+
+    versions_key = _get_versions_key(asset, use_all_form_versions)
+    cache_key = _formpack_cache_key(asset.uid, use_all_form_versions)
+
+    built = _get_cached_formpack(cache_key, versions_key)
+    if built is None:
+        built = _build_formpack(asset, use_all_form_versions)
+        _cache_formpack(cache_key, versions_key, built)
+    pack, version_ids_newest_first, _reversion_ids = built
+
+    if use_all_form_versions:
+        _infer_version_id = _build_version_id_resolver(
+            version_ids_newest_first, _reversion_ids)
+    else:
+        def _infer_version_id(submission):
             submission[INFERRED_VERSION_ID_KEY] = version_ids_newest_first[0]
             return submission
 
-        submission_version_ids = [
-            val for key, val in submission.iteritems()
-                if FUZZY_VERSION_ID_KEY in key
-        ]
-        # Replace any deprecated reversion IDs with the UIDs of their
-        # corresponding AssetVersions
-        submission_version_ids = [
-            _reversion_ids[x] if x in _reversion_ids
-                else x for x in submission_version_ids
-        ]
-        inferred_version_id = None
-        for extant_version_id in version_ids_newest_first:
-            if extant_version_id in submission_version_ids:
-                inferred_version_id = extant_version_id
-                break
-        if not inferred_version_id:
-            # Fall back on the latest version
-            # TODO: log a warning?
-            inferred_version_id = version_ids_newest_first[0]
-        submission[INFERRED_VERSION_ID_KEY] = inferred_version_id
-        return submission
-
     if submission_stream is None:
         _userform_id = asset.deployment.mongo_userform_id
         if not _userform_id.startswith(asset.owner.username):
@@ -124,6 +280,14 @@ def _vnames(asset, cache=False):
 def data_by_identifiers(asset, field_names=None, submission_stream=None,
                         report_styles=None, lang=None, fields=None,
                         split_by=None):
+    '''
+    Return the report statistics of the questions named in `field_names`, or
+    of all questions if `None`. Unless a `submission_stream` is given, the
+    statistics of the questions in `AGGREGATABLE_DATA_TYPES` are computed by
+    the deployment backend from the number of submissions per value, and
+    only the others require reading every submission
+    '''
+    aggregate = submission_stream is None
     pack, submission_stream = build_formpack(asset, submission_stream)
     _all_versions = pack.versions.keys()
     report = pack.autoreport(versions=_all_versions)
@@ -156,7 +320,7 @@ def data_by_identifiers(asset, field_names=None, submission_stream=None,
                          'frequencies': frequencies,
                          'percentages': percentages})
 
-    def _package_stat(field, _, stat, split_by):
+    def _package_stat(field, stat, split_by):
         identifier = kuids.get(field.name)
         if not split_by:
             _stat_dict_to_array(stat, field.name)
@@ -171,9 +335,155 @@ def data_by_identifiers(asset, field_names=None, submission_stream=None,
             'style': specified_styles.get(identifier, {}),
         }
 
-    return [_package_stat(*stat_tup, split_by=split_by) for
-            stat_tup in report.get_stats(submission_stream,
-                                         fields=field_names,
-                                         lang=lang,
-                                         split_by=split_by)
-    ]
+    if aggregate:
+        aggregated_fields = [
+            fields_by_name[name] for name in field_names
+            if name in fields_by_name and
+            _is_aggregatable(fields_by_name[name])
+        ]
+    else:
+        aggregated_fields = []
+    aggregated_names = set(field.name for field in aggregated_fields)
+    streamed_names = [
+        name for name in field_names if name not in aggregated_names]
+
+    stats = []
+    if aggregated_fields:
+        versions_key = _get_versions_key(asset)
+        # Every field is counted up to the same submission
+        id_range = asset.deployment.get_submission_id_range()
+        if id_range is None:
+            highest_id = submission_count = None
+        else:
+            highest_id = id_range[1]
+            submission_count = asset.deployment.submission_count
+    if aggregated_fields and not split_by:
+        stats.extend(_get_aggregated_stats(
+            asset, aggregated_fields, lang, versions_key, highest_id,
+            submission_count))
+    elif aggregated_fields:
+        stats.extend(_get_disaggregated_stats(
+            asset, aggregated_fields, fields_by_name[split_by], lang,
+            versions_key, highest_id, submission_count))
+    if streamed_names:
+        stats.extend(
+            (field, stat) for field, _, stat in report.get_stats(
+                submission_stream,
+                fields=streamed_names,
+                lang=lang,
+                split_by=split_by
+            )
+        )
+    # Keep the order of the form
+    field_positions = dict(
+        (name, position) for position, name in enumerate(fields_by_name))
+    stats.sort(key=lambda field_stat: field_positions[field_stat[0].name])
+
+    return [_package_stat(field, stat, split_by=split_by)
+            for field, stat in stats]
+
+
+def _is_aggregatable(field):
+    return field.has_stats and field.data_type in AGGREGATABLE_DATA_TYPES
+
+
+def _get_value_counts(asset, paths, versions_key, highest_id,
+                      submission_count):
+    '''
+    Return the number of submissions of `asset` per combination of values of
+    `paths`, like `get_submission_value_counts()` of the deployment backend,
+    up to the submission whose `_id` is `highest_id`.
+    The counts are cached in `settings.REPORT_CACHE` along with `highest_id`,
+    so that later calls only count the submissions received since. They are
+    counted again from scratch if the cached total does not match
+    `submission_count`, e.g. after deletions, and at least every
+    `settings.REPORT_CACHE_TIMEOUT` seconds, e.g. to include edits
+    '''
+    deployment = asset.deployment
+    if highest_id is None:
+        # Nothing to resume counting from
+        return deployment.get_submission_value_counts(paths)
+
+    cache = caches[settings.REPORT_CACHE]
+    cache_key = 'report:{}:{}:{}'.format(
+        asset.uid, versions_key, hashlib.sha1(json.dumps(paths)).hexdigest())
+    cached = cache.get(cache_key)
+    if cached is not None and cached['last_id'] <= highest_id:
+        counts = cached['counts']
+        start_after = cached['last_id']
+    else:
+        counts = Counter()
+        start_after = None
+
+    if start_after != highest_id:
+        for values, count in deployment.get_submission_value_counts(
+                paths, start_after=start_after, end_at=highest_id):
+            counts[values] += count
+    if start_after is not None and \
+            sum(counts.itervalues()) != submission_count:
+        counts = Counter(dict(deployment.get_submission_value_counts(
+            paths, end_at=highest_id)))
+
+    if cached is None or cached['last_id'] != highest_id or \
+            cached['counts'] is not counts:
+        cache.set(cache_key, {'last_id': highest_id, 'counts': counts},
+                  settings.REPORT_CACHE_TIMEOUT)
+    return counts.items()
+
+
+def _get_aggregated_stats(asset, fields, lang, versions_key, highest_id,
+                          submission_count):
+    '''
+    Yield a (field, stats) tuple for each of `fields`, computed from the
+    number of submissions per distinct value of the field instead of the
+    submissions themselves. The values are counted the way
+    `formpack.reporting.autoreport.AutoReport` counts them before calling
+    `get_stats()`. See `_get_value_counts()` for the other arguments
+    '''
+    for field in fields:
+        metrics = Counter()
+        value_counts = _get_value_counts(
+            asset, [field.path], versions_key, highest_id, submission_count)
+        for (raw_value,), count in value_counts:
+            if raw_value is None:
+                metrics[None] += count
+                continue
+            for value in field.parse_values(raw_value):
+                metrics[value] += count
+            metrics['__submissions__'] += count
+        yield field, field.get_stats(metrics, lang=lang)
+
+
+def _get_disaggregated_stats(asset, fields, split_by_field, lang,
+                             versions_key, highest_id, submission_count):
+    '''
+    Yield a (field, stats) tuple for each of `fields` but `split_by_field`,
+    split by the values of `split_by_field`, computed from the number of
+    submissions per pair of values of `split_by_field` and the field. The
+    values are counted the way `formpack.reporting.autoreport.AutoReport`
+    counts them before calling `get_disaggregated_stats()`. See
+    `_get_value_counts()` for the other arguments
+    '''
+    top_splitters = None
+    for field in fields:
+        if field.name == split_by_field.name:
+            continue
+        metrics = defaultdict(Counter)
+        splitters_rankings = Counter()
+        value_counts = _get_value_counts(
+            asset, [split_by_field.path, field.path], versions_key,
+            highest_id, submission_count)
+        for (splitter, raw_value), count in value_counts:
+            splitters_rankings[splitter] += count
+            if raw_value is None:
+                metrics[splitter][None] += count
+                continue
+            for value in field.parse_values(raw_value):
+                metrics[splitter][value] += count
+            metrics[splitter]['__submissions__'] += count
+        if top_splitters is None:
+            # Every field counts the same submissions
+            top_splitters = [
+                splitter for splitter, _ in splitters_rankings.most_common(5)]
+        yield field, field.get_disaggregated_stats(
+            metrics, top_splitters=top_splitters, lang=lang)
@@ -186,6 +186,10 @@ ALLOWED_ANONYMOUS_PERMISSIONS = (
     'kpi.view_asset',
     'kpi.view_submissions',
 )
+# Number of descendants whose inherited permissions are written per query when
+# recalculating the permissions of a collection tree
+PERMISSION_RECALCULATION_BATCH_SIZE = int(os.environ.get(
+    'PERMISSION_RECALCULATION_BATCH_SIZE', 500))
 
 # run heavy migration scripts by default
 # NOTE: this should be set to False for major deployments. This can take a long time
@@ -381,6 +385,14 @@ KOBO_SURVEY_PREVIEW_EXPIRATION = os.environ.get('KOBO_SURVEY_PREVIEW_EXPIRATION'
 ENKETO_API_TOKEN = os.environ.get('ENKETO_API_TOKEN', 'enketorules')
 # http://apidocs.enketo.org/v2/
 ENKETO_SURVEY_ENDPOINT = 'api/v2/survey/all'
+# Seconds to wait for Enketo before giving up on a request
+ENKETO_REQUEST_TIMEOUT = float(os.environ.get('ENKETO_REQUEST_TIMEOUT', 10))
+# Number of seconds survey links retrieved from Enketo are considered fresh.
+# Stale links are still served while a background task refreshes them
+ENKETO_LINKS_CACHE_TTL = int(os.environ.get('ENKETO_LINKS_CACHE_TTL', 24 * 60 * 60))
+# Minimum number of seconds between two attempts to refresh the survey
+# links of an asset, so that requests do not flood Celery while Enketo is down
+ENKETO_LINKS_RETRY_INTERVAL = int(os.environ.get('ENKETO_LINKS_RETRY_INTERVAL', 5 * 60))
 
 ''' Celery configuration '''
 # Celery 4.0 New lowercase settings.
@@ -506,6 +518,57 @@ if 'KPI_DEFAULT_FILE_STORAGE' in os.environ:
             'private_storage.storage.s3boto3.PrivateS3BotoStorage'
         AWS_PRIVATE_STORAGE_BUCKET_NAME = AWS_STORAGE_BUCKET_NAME
 
+# Size of the chunks in which export results are copied to storage. With S3,
+# chunks are buffered into parts of at least AWS_S3_FILE_BUFFER_SIZE bytes
+# (5 MiB by default) and uploaded as a multipart upload
+EXPORT_UPLOAD_CHUNK_SIZE = int(
+    os.environ.get('EXPORT_UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024))
+
+# Large CSV exports are split into this many `_id` ranges, exported in
+# parallel by Celery workers and stitched together. 1 disables sharding
+EXPORT_SHARDS = int(os.environ.get('EXPORT_SHARDS', 1))
+EXPORT_SHARDING_MIN_SUBMISSIONS = int(
+    os.environ.get('EXPORT_SHARDING_MIN_SUBMISSIONS', 100000))
+EXPORT_SHARD_MAX_RETRIES = int(os.environ.get('EXPORT_SHARD_MAX_RETRIES', 3))
+
+# Minimum number of seconds between two saves of the progress of a running
+# import or export
+IMPORT_EXPORT_PROGRESS_INTERVAL = float(
+    os.environ.get('IMPORT_EXPORT_PROGRESS_INTERVAL', 5))
+
+# `FormPack`s built for reports and exports are kept, pickled, in the memory
+# of each process (up to FORMPACK_CACHE_SIZE of them) and in this cache, for
+# FORMPACK_CACHE_TIMEOUT seconds. They are discarded when the form is deployed.
+# This cache is skipped if it is local to each process, e.g. a LocMemCache
+FORMPACK_CACHE = os.environ.get('FORMPACK_CACHE', 'default')
+FORMPACK_CACHE_SIZE = int(os.environ.get('FORMPACK_CACHE_SIZE', 100))
+FORMPACK_CACHE_TIMEOUT = int(
+    os.environ.get('FORMPACK_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Submission counts behind report statistics are kept in this cache and
+# updated with new submissions only, but recounted at least every
+# REPORT_CACHE_TIMEOUT seconds to include edited submissions
+REPORT_CACHE = os.environ.get('REPORT_CACHE', 'default')
+REPORT_CACHE_TIMEOUT = int(os.environ.get('REPORT_CACHE_TIMEOUT', 60 * 60))
+
+# Number of seconds to wait for a response from the endpoint of a hook
+HOOK_REQUEST_TIMEOUT = int(os.environ.get('HOOK_REQUEST_TIMEOUT', 30))
+# Submissions to hooks in batch delivery mode are grouped for
+# HOOK_BATCH_WINDOW seconds and sent by one task, HOOK_BATCH_SIZE at most
+HOOK_BATCH_WINDOW = int(os.environ.get('HOOK_BATCH_WINDOW', 10))
+HOOK_BATCH_SIZE = int(os.environ.get('HOOK_BATCH_SIZE', 500))
+# Failed submissions are retried with at most HOOK_RETRY_CONCURRENCY
+# simultaneous requests and HOOK_RETRY_RATE_LIMIT requests per second to
+# each host (0 disables the limit)
+HOOK_RETRY_CONCURRENCY = int(os.environ.get('HOOK_RETRY_CONCURRENCY', 10))
+HOOK_RETRY_RATE_LIMIT = float(os.environ.get('HOOK_RETRY_RATE_LIMIT', 20))
+# Failure reports are built for HOOK_FAILURES_REPORT_CHUNK_SIZE owners at a
+# time and list the HOOK_FAILURES_REPORT_MAX_LOGS latest failures of each hook
+HOOK_FAILURES_REPORT_CHUNK_SIZE = int(
+    os.environ.get('HOOK_FAILURES_REPORT_CHUNK_SIZE', 100))
+HOOK_FAILURES_REPORT_MAX_LOGS = int(
+    os.environ.get('HOOK_FAILURES_REPORT_MAX_LOGS', 50))
+
 
 # Need a default logger when sentry is not activated
 
@@ -673,3 +736,12 @@ else:
 MONGO_CONNECTION = MongoClient(
     MONGO_CONNECTION_URL, j=True, tz_aware=True, connect=False)
 MONGO_DB = MONGO_CONNECTION[MONGO_DATABASE['NAME']]
+# Number of submissions retrieved from Mongo per round trip
+MONGO_DB_BATCH_SIZE = int(os.environ.get('MONGO_DB_BATCH_SIZE', 1000))
+# Prevent Mongo from discarding idle submission cursors. Reads resume after
+# the last retrieved submission if a cursor is lost anyway
+MONGO_DB_NO_CURSOR_TIMEOUT = os.environ.get(
+    'MONGO_DB_NO_CURSOR_TIMEOUT', 'False') == 'True'
+# Number of `_id` ranges read concurrently when retrieving all the
+# submissions of a form
+MONGO_DB_PARALLEL_SCANS = int(os.environ.get('MONGO_DB_PARALLEL_SCANS', 1))
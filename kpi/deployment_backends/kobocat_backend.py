@@ -2,16 +2,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import Queue
 import cStringIO
 import json
 import re
 import requests
+import sys
+import threading
+import time
 import unicodecsv
 import urlparse
 import posixpath
 
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import CursorNotFound
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 from pyxform.xls2json_backends import xls_to_dict
 from rest_framework import exceptions, status, serializers
@@ -26,6 +34,9 @@ from kpi.constants import INSTANCE_FORMAT_TYPE_JSON, INSTANCE_FORMAT_TYPE_XML
 from kpi.utils.mongo_helper import MongoDecodingHelper
 from kpi.utils.log import logging
 
+# Shared by all deployments so that connections to Enketo are pooled
+_enketo_session = requests.Session()
+
 
 class KobocatDeploymentException(exceptions.APIException):
     def __init__(self, *args, **kwargs):
@@ -287,6 +298,7 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
             'backend_response': json_response,
             'version': self.asset.version_id,
         })
+        self.refresh_enketo_survey_links()
 
     def redeploy(self, active=None):
         '''
@@ -319,6 +331,7 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
                 'backend_response': json_response,
                 'version': self.asset.version_id,
             })
+            self.refresh_enketo_survey_links()
         except KobocatDeploymentException as e:
             if hasattr(e, 'response') and e.response.status_code == 404:
                 # Whoops, the KC project we thought we were going to overwrite
@@ -379,7 +392,14 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
                 raise
         super(KobocatDeploymentBackend, self).delete()
 
-    def get_enketo_survey_links(self):
+    @property
+    def _enketo_links_key(self):
+        ''' Links are only valid for the owner and form they were retrieved
+        for; a change to either invalidates the cached links '''
+        return [self.asset.owner.username, self.backend_response['id_string']]
+
+    def _fetch_enketo_survey_links(self):
+        ''' Ask Enketo for the survey links. Returns `None` upon failure '''
         data = {
             'server_url': u'{}/{}'.format(
                 settings.KOBOCAT_URL.rstrip('/'),
@@ -388,24 +408,24 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
             'form_id': self.backend_response['id_string']
         }
         try:
-            response = requests.post(
+            response = _enketo_session.post(
                 u'{}{}'.format(
                     settings.ENKETO_SERVER, settings.ENKETO_SURVEY_ENDPOINT),
                 # bare tuple implies basic auth
                 auth=(settings.ENKETO_API_TOKEN, ''),
-                data=data
+                data=data,
+                timeout=settings.ENKETO_REQUEST_TIMEOUT
             )
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
-            # Don't 500 the entire asset view if Enketo is unreachable
             logging.error(
                 'Failed to retrieve links from Enketo', exc_info=True)
-            return {}
+            return None
         try:
             links = response.json()
         except ValueError:
             logging.error('Received invalid JSON from Enketo', exc_info=True)
-            return {}
+            return None
         for discard in ('enketo_id', 'code', 'preview_iframe_url'):
             try:
                 del links[discard]
@@ -413,6 +433,80 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
                 pass
         return links
 
+    def refresh_enketo_survey_links(self):
+        '''
+        Retrieve the survey links from Enketo and cache them in
+        `self.asset._deployment_data`. The caller is responsible for saving
+        the asset. Returns the links, or `None` if Enketo could not be reached
+        '''
+        links = self._fetch_enketo_survey_links()
+        if links is not None:
+            self.store_data({
+                'enketo_links': {
+                    'key': self._enketo_links_key,
+                    'links': links,
+                    'retrieved': time.time(),
+                }
+            })
+        return links
+
+    def get_enketo_survey_links(self):
+        '''
+        Return the survey links cached in the deployment data without
+        contacting Enketo. Missing or stale links are refreshed by a
+        background task, at most once every
+        `settings.ENKETO_LINKS_RETRY_INTERVAL` seconds; until then, stale
+        links (or nothing) are returned
+        '''
+        cached = self.asset._deployment_data.get('enketo_links', {})
+        if cached.get('key') == self._enketo_links_key:
+            links = cached['links']
+            expired = time.time() - cached['retrieved'] > \
+                settings.ENKETO_LINKS_CACHE_TTL
+        else:
+            links = {}
+            expired = True
+        if expired and self._claim_enketo_links_refresh():
+            # Avoid circular import
+            from kpi.tasks import refresh_enketo_survey_links
+            refresh_enketo_survey_links.delay(self.asset.uid)
+        return links
+
+    def _claim_enketo_links_refresh(self):
+        '''
+        Record in the deployment data that the survey links are being
+        refreshed, unless it was already done less than
+        `settings.ENKETO_LINKS_RETRY_INTERVAL` seconds ago, e.g. by another
+        request while Enketo is unreachable. Returns whether the caller
+        should refresh the links
+        '''
+        now = time.time()
+        cached = self.asset._deployment_data.get('enketo_links', {})
+        if now - cached.get('last_attempt', 0) < \
+                settings.ENKETO_LINKS_RETRY_INTERVAL:
+            return False
+        if self.asset.pk is None:
+            return False
+        # Avoid circular import
+        from kpi.models import Asset
+        with transaction.atomic():
+            current = Asset.objects.select_for_update().only(
+                '_deployment_data').get(pk=self.asset.pk)
+            deployment_data = current._deployment_data
+            if deployment_data.get('backend') != self.backend:
+                return False
+            current_cached = deployment_data.get('enketo_links', {})
+            if now - current_cached.get('last_attempt', 0) < \
+                    settings.ENKETO_LINKS_RETRY_INTERVAL:
+                return False
+            deployment_data['enketo_links'] = dict(
+                current_cached, last_attempt=now)
+            Asset.objects.filter(pk=self.asset.pk).update(
+                _deployment_data=deployment_data)
+        self.asset._deployment_data['enketo_links'] = dict(
+            cached, last_attempt=now)
+        return True
+
     def get_data_download_links(self):
         exports_base_url = u'/'.join((
             settings.KOBOCAT_URL.rstrip('/'),
@@ -446,6 +540,11 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
         return links
 
     def _submission_count(self):
+        # `Asset.optimize_queryset_for_list()` may have retrieved this already
+        try:
+            return self.asset.prefetched_submission_count or 0
+        except AttributeError:
+            pass
         _deployment_data = self.asset._deployment_data
         id_string = _deployment_data['backend_response']['id_string']
         # avoid migrations from being created for kc_access mocked models
@@ -488,7 +587,9 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
         )
         return url
 
-    def get_submissions(self, format_type=INSTANCE_FORMAT_TYPE_JSON, instances_ids=[]):
+    def get_submissions(self, format_type=INSTANCE_FORMAT_TYPE_JSON,
+                        instances_ids=[], fields=None, start_after=None,
+                        submitted_since=None, end_at=None):
         """
         Retreives submissions through Postgres or Mongo depending on `format_type`.
         It can be filtered on instances uuids.
@@ -496,11 +597,20 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
 
         :param format_type: str. INSTANCE_FORMAT_TYPE_JSON|INSTANCE_FORMAT_TYPE_XML
         :param instances_ids: list. Optional
+        :param fields: list. Optional. JSON only. Top-level submission keys
+            to retrieve; `_id` is always included
+        :param start_after: int. Optional. JSON only. Skip submissions whose
+            `_id` is not greater than this one, e.g. to resume a read
+        :param submitted_since: str. Optional. JSON only. Skip submissions
+            whose `_submission_time` is earlier than this one
+        :param end_at: int. Optional. JSON only. Skip submissions whose `_id`
+            is greater than this one, e.g. to read a range of them
         :return: list: mixed
         """
         submissions = []
         if format_type == INSTANCE_FORMAT_TYPE_JSON:
-            submissions = self.__get_submissions_in_json(instances_ids)
+            submissions = self.__get_submissions_in_json(
+                instances_ids, fields, start_after, submitted_since, end_at)
         elif format_type == INSTANCE_FORMAT_TYPE_XML:
             submissions = self.__get_submissions_in_xml(instances_ids)
         else:
@@ -526,28 +636,259 @@ class KobocatDeploymentBackend(BaseDeploymentBackend):
         else:
             raise ValueError("Primary key must be provided")
 
-    def __get_submissions_in_json(self, instances_ids=[]):
+    def get_submissions_by_id(self, instances_ids,
+                              format_type=INSTANCE_FORMAT_TYPE_JSON):
         """
-        Retrieves instances directly from Mongo.
+        Returns the submissions whose `Instance.id` are in `instances_ids`,
+        with one query.
+
+        :param instances_ids: list. `Instance.id`s
+        :param format_type: str.  INSTANCE_FORMAT_TYPE_JSON|INSTANCE_FORMAT_TYPE_XML
+        :return: dict. JSON or XML submissions keyed by `Instance.id`
+        """
+        if format_type == INSTANCE_FORMAT_TYPE_XML:
+            # XML does not contain `Instance.id`, read it from Postgres
+            queryset = _models.Instance.objects.filter(
+                xform_id=self.xform_id,
+                deleted_at=None,
+                id__in=instances_ids
+            ).values_list("id", "xml")
+            return dict(queryset)
+
+        return dict(
+            (submission["_id"], submission)
+            for submission in self.get_submissions(format_type, instances_ids)
+        )
+
+    def __get_submissions_in_json(self, instances_ids=[], fields=None,
+                                  start_after=None, submitted_since=None,
+                                  end_at=None):
+        """
+        Retrieves instances directly from Mongo, ordered by `_id`.
 
         :param instances_ids: list. Optional
+        :param fields: list. Optional
+        :param start_after: int. Optional
+        :param submitted_since: str. Optional
+        :param end_at: int. Optional
         :return: generator<JSON>
         """
-        query = {
-            "_userform_id": self.mongo_userform_id,
-            "_deleted_at": {"$exists": False}
-        }
+        query = self.__get_mongo_query()
 
         if len(instances_ids) > 0:
             query.update({
                 "_id": {"$in": instances_ids}
             })
 
-        instances = settings.MONGO_DB.instances.find(query)
-        return (
-            MongoDecodingHelper.to_readable_dict(instance)
-            for instance in instances
+        if submitted_since is not None:
+            query.update({
+                "_submission_time": {"$gte": submitted_since}
+            })
+
+        projection = None
+        if fields is not None:
+            projection = dict.fromkeys(
+                (MongoDecodingHelper.encode(field) for field in fields), True)
+            projection['_id'] = True
+
+        if len(instances_ids) == 0 and end_at is None and \
+                settings.MONGO_DB_PARALLEL_SCANS > 1:
+            return self._read_mongo_instances_in_parallel(
+                query, projection, start_after,
+                settings.MONGO_DB_PARALLEL_SCANS
+            )
+        return self._read_mongo_instances(
+            query, projection, start_after, end_at)
+
+    def __get_mongo_query(self):
+        return {
+            "_userform_id": self.mongo_userform_id,
+            "_deleted_at": {"$exists": False}
+        }
+
+    def get_submission_value_counts(self, fields, start_after=None,
+                                    end_at=None):
+        """
+        Counts the submissions by each combination of values of the given
+        top-level `fields` with an aggregation pipeline, without transferring
+        the submissions out of Mongo.
+
+        :param fields: list. Submission keys, e.g. `group/question`
+        :param start_after: int. Optional. Skip submissions whose `_id` is not
+            greater than this one
+        :param end_at: int. Optional. Skip submissions whose `_id` is greater
+            than this one
+        :return: list<tuple>. (values, count) pairs, where `values` is a tuple
+            with the value of each field, `None` if missing
+        """
+        query = self.__get_mongo_query()
+        if start_after is not None or end_at is not None:
+            query['_id'] = {}
+            if start_after is not None:
+                query['_id']['$gt'] = start_after
+            if end_at is not None:
+                query['_id']['$lte'] = end_at
+        group_id = dict(
+            ('f{}'.format(index), '$' + MongoDecodingHelper.encode(field))
+            for index, field in enumerate(fields)
         )
+        pipeline = [
+            {'$match': query},
+            {'$group': {'_id': group_id, 'count': {'$sum': 1}}},
+        ]
+        counts = []
+        for group in settings.MONGO_DB.instances.aggregate(
+                pipeline, allowDiskUse=True):
+            # Missing fields are left out of `_id`
+            values = tuple(
+                group['_id'].get('f{}'.format(index))
+                for index in range(len(fields))
+            )
+            counts.append((values, group['count']))
+        return counts
+
+    def get_submission_id_range(self):
+        """
+        Returns the lowest and the highest `_id` of the submissions, e.g. to
+        split them into ranges, or `None` if there are none.
+
+        :return: tuple<int>
+        """
+        query = self.__get_mongo_query()
+        first = settings.MONGO_DB.instances.find_one(
+            query, {'_id': True}, sort=[('_id', ASCENDING)])
+        if first is None:
+            return None
+        last = settings.MONGO_DB.instances.find_one(
+            query, {'_id': True}, sort=[('_id', DESCENDING)])
+        return first['_id'], last['_id']
+
+    @staticmethod
+    def _read_mongo_instances(query, projection=None, start_after=None,
+                              end_at=None):
+        """
+        Yields decoded instances matching `query` whose `_id` is greater than
+        `start_after` and no greater than `end_at`, in `_id` order. If Mongo
+        discards the cursor, reading resumes after the last `_id` received.
+        Relies on the `{_userform_id: 1, _id: 1}` index created by the
+        `create_mongo_indexes` management command.
+
+        :return: generator<JSON>
+        """
+        last_id = start_after
+        while True:
+            resumed_from = last_id
+            bounds = {}
+            if last_id is not None:
+                bounds['$gt'] = last_id
+            if end_at is not None:
+                bounds['$lte'] = end_at
+            range_query = dict(query)
+            if bounds:
+                range_query['_id'] = dict(query.get('_id', {}), **bounds)
+            cursor = settings.MONGO_DB.instances.find(
+                range_query,
+                projection,
+                sort=[('_id', ASCENDING)],
+                batch_size=settings.MONGO_DB_BATCH_SIZE,
+                no_cursor_timeout=settings.MONGO_DB_NO_CURSOR_TIMEOUT
+            )
+            try:
+                for instance in cursor:
+                    last_id = instance['_id']
+                    yield MongoDecodingHelper.to_readable_dict(instance)
+                return
+            except CursorNotFound:
+                if last_id == resumed_from:
+                    # Lost the cursor without making any progress
+                    raise
+                logging.warning(
+                    'Lost Mongo cursor; resuming after _id {}'.format(last_id))
+            finally:
+                # Cursors opened with `no_cursor_timeout` are only freed on
+                # the server when closed explicitly
+                cursor.close()
+
+    @classmethod
+    def _read_mongo_instances_in_parallel(cls, query, projection=None,
+                                          start_after=None, scans=2):
+        """
+        Splits the `_id` range of the instances matching `query` into `scans`
+        contiguous ranges, reads them concurrently, and yields the decoded
+        instances range by range to preserve `_id` order. At most
+        `settings.MONGO_DB_BATCH_SIZE` instances are buffered per range.
+
+        :return: generator<JSON>
+        """
+        if start_after is not None:
+            query = dict(query, _id={'$gt': start_after})
+        first = settings.MONGO_DB.instances.find_one(
+            query, {'_id': True}, sort=[('_id', ASCENDING)])
+        last = settings.MONGO_DB.instances.find_one(
+            query, {'_id': True}, sort=[('_id', DESCENDING)])
+        if first is None:
+            return
+        lowest, highest = first['_id'], last['_id']
+        if not isinstance(lowest, (int, long)) or \
+                not isinstance(highest, (int, long)):
+            # Only KoBoCAT's integer ids can be split into ranges
+            for instance in cls._read_mongo_instances(query, projection):
+                yield instance
+            return
+
+        span = highest - lowest + 1
+        # Each range is (exclusive lower bound, inclusive upper bound)
+        boundaries = [lowest - 1 + span * i // scans for i in range(scans)]
+        boundaries.append(highest)
+        ranges = zip(boundaries[:-1], boundaries[1:])
+
+        finished = object()
+        stop = threading.Event()
+
+        def _scan(range_queue, start, end):
+            try:
+                for instance in cls._read_mongo_instances(
+                        query, projection, start, end):
+                    while not stop.is_set():
+                        try:
+                            range_queue.put(instance, timeout=1)
+                            break
+                        except Queue.Full:
+                            continue
+                    else:
+                        return
+                item = finished
+            except Exception:
+                item = sys.exc_info()
+            while not stop.is_set():
+                try:
+                    range_queue.put(item, timeout=1)
+                    break
+                except Queue.Full:
+                    continue
+
+        queues = []
+        for start, end in ranges:
+            range_queue = Queue.Queue(maxsize=settings.MONGO_DB_BATCH_SIZE)
+            thread = threading.Thread(
+                target=_scan, args=(range_queue, start, end))
+            thread.daemon = True
+            thread.start()
+            queues.append(range_queue)
+
+        try:
+            for range_queue in queues:
+                while True:
+                    item = range_queue.get()
+                    if item is finished:
+                        break
+                    if isinstance(item, tuple):
+                        # The scan failed, keep its traceback
+                        six.reraise(*item)
+                    yield item
+        finally:
+            # Let the remaining scans exit if the consumer stops early
+            stop.set()
 
     def __get_submissions_in_xml(self, instances_ids=[]):
         """
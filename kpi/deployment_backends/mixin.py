@@ -15,6 +15,7 @@ from rest_framework.decorators import detail_route, list_route
 from .backends import DEPLOYMENT_BACKENDS
 from .kobocat_backend import KobocatDeploymentBackend
 from .mock_backend import MockDeploymentBackend
+from kobo.apps.reports.report_data import invalidate_formpack_cache
 from kpi.exceptions import BadAssetTypeException
 from kpi.constants import ASSET_TYPE_SURVEY
 
@@ -50,7 +51,9 @@ class DeployableMixin:
         `deploy()` above """
         latest_version = self.latest_version
         latest_version.deployed = True
+        latest_version.materialize_formpack_content()
         latest_version.save()
+        invalidate_formpack_cache(self.uid)
 
     @property
     def has_deployment(self):
@@ -60,11 +63,19 @@ class DeployableMixin:
     def deployment(self):
         if not self.has_deployment:
             raise Exception('must call asset.connect_deployment first')
+        backend = self._deployment_data['backend']
+        # Serializers access this property many times per asset; reuse the
+        # same backend instance as long as the backend does not change
+        cached = getattr(self, '_cached_deployment', None)
+        if cached is not None and cached.asset is self and \
+                isinstance(cached, DEPLOYMENT_BACKENDS.get(backend, ())):
+            return cached
         try:
-            backend = self._deployment_data['backend']
-            return DEPLOYMENT_BACKENDS[backend](self)
+            deployment = DEPLOYMENT_BACKENDS[backend](self)
         except KeyError as e:
             raise KeyError('cannot retrieve asset backend: {}'.format(backend))
+        self._cached_deployment = deployment
+        return deployment
 
     @property
     def can_be_deployed(self):
@@ -1,6 +1,10 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import re
+from collections import Counter
+
+import dateutil.parser
+import pytz
 
 from base_backend import BaseDeploymentBackend
 from kpi.constants import INSTANCE_FORMAT_TYPE_JSON, INSTANCE_FORMAT_TYPE_XML
@@ -49,10 +53,26 @@ class MockDeploymentBackend(BaseDeploymentBackend):
     def get_data_download_links(self):
         return {}
 
+    @property
+    def mongo_userform_id(self):
+        return '{}_{}'.format(self.asset.owner.username, self.asset.uid)
+
     def _submission_count(self):
         submissions = self.asset._deployment_data.get('submissions', [])
         return len(submissions)
 
+    def _last_submission_time(self):
+        submission_times = [
+            submission['_submission_time']
+            for submission in self.asset._deployment_data.get('submissions', [])
+            if isinstance(submission, dict) and '_submission_time' in submission
+        ]
+        if not submission_times:
+            return None
+        # Mock timestamps, like Mongo's, are UTC without any time zone
+        return dateutil.parser.parse(max(submission_times)).replace(
+            tzinfo=pytz.UTC)
+
     def _mock_submission(self, submission):
         """
         @TODO may be useless because of mock_submissions. Remove if it's not used anymore anywhere else.
@@ -72,12 +92,16 @@ class MockDeploymentBackend(BaseDeploymentBackend):
         self.store_data({"submissions": submissions})
         self.asset.save(create_version=False)
 
-    def get_submissions(self, format_type=INSTANCE_FORMAT_TYPE_JSON, instances_ids=[]):
+    def get_submissions(self, format_type=INSTANCE_FORMAT_TYPE_JSON, instances_ids=[],
+                        submitted_since=None, start_after=None, end_at=None):
         """
         Returns a list of json representation of instances.
 
         :param format_type: str. xml or json
         :param instances_ids: list. Ids of instances to retrieve
+        :param submitted_since: str. Optional. JSON only. Earliest `_submission_time` to retrieve
+        :param start_after: int. Optional. JSON only. `_id` to retrieve instances after
+        :param end_at: int. Optional. JSON only. Last `_id` to retrieve
         :return: list
         """
         submissions = self.asset._deployment_data.get("submissions", [])
@@ -91,6 +115,59 @@ class MockDeploymentBackend(BaseDeploymentBackend):
             else:
                 submissions = [submission for submission in submissions if submission.get("id") in instances_ids]
 
+        if submitted_since is not None and format_type == INSTANCE_FORMAT_TYPE_JSON:
+            submissions = [submission for submission in submissions
+                           if submission.get("_submission_time", "") >= submitted_since]
+
+        if start_after is not None and format_type == INSTANCE_FORMAT_TYPE_JSON:
+            submissions = [submission for submission in submissions
+                           if submission["_id"] > start_after]
+
+        if end_at is not None and format_type == INSTANCE_FORMAT_TYPE_JSON:
+            submissions = [submission for submission in submissions
+                           if submission["_id"] <= end_at]
+
+        return submissions
+
+    def get_submission_value_counts(self, fields, start_after=None,
+                                    end_at=None):
+        counts = Counter(
+            tuple(submission.get(field) for field in fields)
+            for submission in self.get_submissions(
+                start_after=start_after, end_at=end_at)
+        )
+        return counts.items()
+
+    def get_submission_id_range(self):
+        submission_ids = [
+            submission['_id']
+            for submission in self.asset._deployment_data.get('submissions', [])
+            if isinstance(submission, dict) and '_id' in submission
+        ]
+        if not submission_ids:
+            return None
+        return min(submission_ids), max(submission_ids)
+
+    def get_submissions_by_id(self, instances_ids,
+                              format_type=INSTANCE_FORMAT_TYPE_JSON):
+        """
+        Returns a dict of the submissions whose ids are in `instances_ids`,
+        keyed by their ids
+
+        :param instances_ids: list
+        :param format_type: str. xml or json
+        :return: dict
+        """
+        instances_ids = set(instances_ids)
+        submissions = {}
+        for submission in self.asset._deployment_data.get("submissions", []):
+            if format_type == INSTANCE_FORMAT_TYPE_XML:
+                match = re.search(r"<id>(\d+)<\/id>", submission)
+                instance_id = int(match.group(1)) if match else None
+            else:
+                instance_id = submission.get("id")
+            if instance_id in instances_ids:
+                submissions[instance_id] = submission
         return submissions
 
     def get_submission(self, pk, format_type=INSTANCE_FORMAT_TYPE_JSON):
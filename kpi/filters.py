@@ -56,6 +56,13 @@ class KpiObjectPermissionsFilter(object):
 
         if user.is_anonymous():
             user = get_anonymous_user()
+        if view.action != 'list':
+            # Not a list, so discoverability doesn't matter. Let the database
+            # consider both the user's and the public's permissions at once
+            return get_objects_for_user(
+                user, permission, queryset, include_public=True)
+
+        if user.pk == settings.ANONYMOUS_USER_ID:
             # Avoid giving anonymous users special treatment when viewing
             # public objects
             owned_and_explicitly_shared = queryset.none()
@@ -64,9 +71,6 @@ class KpiObjectPermissionsFilter(object):
                 user, permission, queryset)
         public = get_objects_for_user(
             get_anonymous_user(), permission, queryset)
-        if view.action != 'list':
-            # Not a list, so discoverability doesn't matter
-            return (owned_and_explicitly_shared | public).distinct()
 
         # For a list, do not include public objects unless they are also
         # discoverable
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+# Submissions of a form are read and paged in `_id` order,
+# see `KobocatDeploymentBackend._read_mongo_instances()`
+INSTANCES_INDEXES = [
+    [('_userform_id', ASCENDING), ('_id', ASCENDING)],
+]
+
+
+class Command(BaseCommand):
+
+    help = "Creates the indexes of the Mongo `instances` collection needed " \
+           "to read submissions. Existing indexes are left untouched"
+
+    def handle(self, *args, **options):
+        for keys in INSTANCES_INDEXES:
+            try:
+                # `create_index()` does nothing if the index already exists
+                name = settings.MONGO_DB.instances.create_index(
+                    keys, background=True)
+            except PyMongoError as e:
+                # Reported without a traceback, with a non-zero exit status
+                raise CommandError("Could not create index {}: {}".format(
+                    keys, str(e)))
+            self.stdout.write("Index `{}` is ready".format(name))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from kpi.models import AssetVersion
+
+
+class Command(BaseCommand):
+    help = ('Store the expanded content of deployed asset versions that were '
+            'deployed before it was saved at deployment time')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+                    action='store',
+                    dest='batch_size',
+                    type='int',
+                    default=100,
+                    help='Number of versions to update per transaction'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        verbosity = options['verbosity']
+        versions = AssetVersion.objects.filter(
+            deployed=True, formpack_content__isnull=True
+        ).only(
+            'uid', 'version_content', 'deployed_content',
+            '_reversion_version', 'formpack_content'
+        ).order_by('pk')
+
+        last_pk = 0
+        updated = failed = 0
+        while True:
+            batch = list(versions.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for version in batch:
+                    if version.materialize_formpack_content():
+                        version.save(update_fields=['formpack_content'])
+                        updated += 1
+                    else:
+                        failed += 1
+            last_pk = batch[-1].pk
+            if verbosity > 1:
+                self.stdout.write('Updated {} versions, up to pk {}'.format(
+                    updated, last_pk))
+
+        if verbosity:
+            self.stdout.write(
+                'Updated {} versions; failed to expand {}'.format(
+                    updated, failed))
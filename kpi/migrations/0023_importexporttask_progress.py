@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi', '0022_assetfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exporttask',
+            name='progress',
+            field=jsonfield.fields.JSONField(default={}),
+        ),
+        migrations.AddField(
+            model_name='importtask',
+            name='progress',
+            field=jsonfield.fields.JSONField(default={}),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonbfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi', '0023_importexporttask_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assetversion',
+            name='formpack_content',
+            field=jsonbfield.fields.JSONField(null=True),
+        ),
+    ]
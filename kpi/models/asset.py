@@ -11,8 +11,10 @@ from collections import OrderedDict
 
 import xlwt
 import six
+from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
 from django.core.exceptions import MultipleObjectsReturned
+from django.db import connection
 from django.db import models
 from django.db import transaction
 from django.db.models import Prefetch
@@ -799,10 +801,29 @@ class Asset(ObjectPermissionMixin,
                 'asset_versions',
                 queryset=AssetVersion.objects.order_by(
                     '-date_modified'
-                ).only('uid', 'asset', 'date_modified', 'deployed'),
+                ).only('uid', 'asset', 'date_modified', 'deployed',
+                       '_reversion_version'),
                 to_attr='prefetched_latest_versions',
             ),
         )
+        if settings.DEFAULT_DEPLOYMENT_BACKEND == 'kobocat' and \
+                connection.vendor == 'postgresql':
+            # Read each asset's submission count from the KC `XForm` table in
+            # the same query instead of once per asset. KC shares our
+            # database, but the XForm's `id_string` is only available from
+            # the `_deployment_data` JSON text. Assets without a KC XForm get
+            # `NULL`
+            queryset = queryset.extra(select={
+                'prefetched_submission_count': '''
+                    SELECT logger_xform.num_of_submissions
+                    FROM logger_xform
+                    WHERE logger_xform.user_id = kpi_asset.owner_id
+                    AND logger_xform.id_string = (
+                        kpi_asset._deployment_data::json
+                        #>> '{backend_response,id_string}'
+                    )
+                '''
+            })
         return queryset
 
 
@@ -9,6 +9,7 @@ from jsonbfield.fields import JSONField as JSONBField
 from reversion.models import Version
 from ..fields import KpiUidField
 from ..utils.kobo_to_xlsform import to_xlsform_structure
+from kpi.utils.log import logging
 
 from formpack.utils.expand_content import expand_content
 
@@ -30,6 +31,8 @@ class AssetVersion(models.Model):
     version_content = JSONBField()
     uid_aliases = JSONBField(null=True)
     deployed_content = JSONBField(null=True)
+    # `expand_content()` of `_deployed_content()`, saved when deploying
+    formpack_content = JSONBField(null=True)
     _deployment_data = JSONBField(default=False)
     deployed = models.BooleanField(default=False)
 
@@ -39,7 +42,8 @@ class AssetVersion(models.Model):
     def _deployed_content(self):
         if self.deployed_content is not None:
             return self.deployed_content
-        legacy_names = self._reversion_version is not None
+        # Compare the id to avoid fetching the `Version`
+        legacy_names = self._reversion_version_id is not None
         if legacy_names:
             return to_xlsform_structure(self.version_content,
                                         deprecated_autoname=True)
@@ -47,9 +51,32 @@ class AssetVersion(models.Model):
             return to_xlsform_structure(self.version_content,
                                         move_autonames=True)
 
+    def _formpack_content(self):
+        if self.formpack_content is not None:
+            return self.formpack_content
+        return expand_content(self._deployed_content())
+
+    def materialize_formpack_content(self):
+        '''
+        Store the expanded content used by `to_formpack_schema()` in
+        `formpack_content`, so it does not need to be computed again. Does not
+        save the version. Returns `False` if the content could not be expanded
+        '''
+        try:
+            self.formpack_content = expand_content(self._deployed_content())
+        # See `build_formpack()`
+        except TypeError as e:
+            logging.error(
+                'Failed to expand content of version {}: {}'.format(
+                    self.uid, repr(e)),
+                exc_info=True
+            )
+            return False
+        return True
+
     def to_formpack_schema(self):
         return {
-            'content': expand_content(self._deployed_content()),
+            'content': self._formpack_content(),
             'version': self.uid,
             'version_id_key': '__version__',
         }
@@ -118,6 +118,17 @@ class Collection(ObjectPermissionMixin, TagStringMixin, MPTTModel):
         ''' Returns all children, both Assets and Collections '''
         return CollectionChildrenQuerySet(self)
 
+    def get_mixed_descendants(self):
+        ''' Returns a list of two querysets that contain all descendants:
+        Collections, ordered so that parents precede their children, and
+        Assets. Relies on the MPTT tree, so the number of queries does not
+        depend on the depth of the tree '''
+        return [
+            self.get_descendants().order_by('tree_id', 'lft'),
+            Asset.objects.filter(
+                parent__in=self.get_descendants(include_self=True)),
+        ]
+
     def __unicode__(self):
         return self.name
 
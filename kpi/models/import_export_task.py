@@ -2,10 +2,13 @@ import re
 import pytz
 import base64
 import datetime
+import time
+import shutil
 import requests
 import tempfile
 import posixpath
 import dateutil.parser
+import unicodecsv
 from io import BytesIO
 from os.path import splitext
 from collections import defaultdict
@@ -67,6 +70,20 @@ def utcnow(*args, **kwargs):
     return datetime.datetime.utcnow()
 
 
+class _ProgressRecordingFile(object):
+    '''
+    Wraps a file opened for writing, and records the number of bytes written
+    to it in the progress of `task`
+    '''
+    def __init__(self, output_file, task):
+        self._output_file = output_file
+        self._task = task
+
+    def write(self, data):
+        self._output_file.write(data)
+        self._task._record_progress(bytes_written=len(data))
+
+
 def _resolve_url_to_asset_or_collection(item_path):
     if item_path.startswith(('http', 'https')):
         item_path = urlparse.urlparse(item_path).path
@@ -105,6 +122,12 @@ class ImportExportTask(models.Model):
         (COMPLETE, COMPLETE),
     )
 
+    # Phases reported in `progress`
+    FETCH = 'fetch'
+    TRANSFORM = 'transform'
+    WRITE = 'write'
+    UPLOAD = 'upload'
+
     user = models.ForeignKey('auth.User')
     data = JSONField()
     messages = JSONField(default={})
@@ -112,6 +135,7 @@ class ImportExportTask(models.Model):
                               default=CREATED)
     date_created = models.DateTimeField(auto_now_add=True)
     # date_expired = models.DateTimeField(null=True)
+    progress = JSONField(default={})
 
     def run(self):
         '''
@@ -119,12 +143,20 @@ class ImportExportTask(models.Model):
         method. Catches all exceptions!  Suitable to be called by an
         asynchronous task runner (Celery)
         '''
+        if self._start():
+            self._execute(self._run_task)
+
+    def _start(self):
+        '''
+        Mark the task as processing. Returns `False` if it is already
+        complete, and raises an exception if it was started before
+        '''
         with transaction.atomic():
             _refetched_self = self._meta.model.objects.get(pk=self.pk)
             self.status = _refetched_self.status
             del _refetched_self
             if self.status == self.COMPLETE:
-                return
+                return False
             elif self.status != self.CREATED:
                 # possibly a concurrent task?
                 raise Exception(
@@ -132,12 +164,76 @@ class ImportExportTask(models.Model):
                         self._meta.model_name)
                 )
             self.status = self.PROCESSING
-            self.save(update_fields=['status'])
+            self._reset_progress()
+            self.save(update_fields=['status', 'progress'])
+        return True
+
+    def _reset_progress(self):
+        self.progress = {
+            'phase': None,
+            'rows': 0,
+            'bytes': 0,
+            'rows_per_second': 0,
+            'started': datetime.datetime.now(pytz.UTC).isoformat(),
+            'updated': None,
+        }
+        self._progress_started = time.time()
+        self._progress_saved = self._progress_started
+
+    def _prepare_progress(self):
+        if not self.progress:
+            self._reset_progress()
+        elif not hasattr(self, '_progress_started'):
+            # The task was started by another process, e.g. the shards of
+            # an export; measure the rate from now on
+            self._progress_started = time.time()
+            self._progress_saved = self._progress_started
+
+    def _set_phase(self, phase):
+        '''
+        Record that the task has entered `phase`, and save the progress
+        immediately
+        '''
+        self._prepare_progress()
+        self.progress['phase'] = phase
+        self._save_progress()
 
+    def _record_progress(self, rows=0, bytes_written=0):
+        '''
+        Add to the numbers of rows processed and bytes written. The progress
+        is saved at most every `settings.IMPORT_EXPORT_PROGRESS_INTERVAL`
+        seconds
+        '''
+        self._prepare_progress()
+        self.progress['rows'] += rows
+        self.progress['bytes'] += bytes_written
+        if time.time() - self._progress_saved >= \
+                settings.IMPORT_EXPORT_PROGRESS_INTERVAL:
+            self._save_progress()
+
+    def _update_progress_rate(self):
+        self._prepare_progress()
+        now = time.time()
+        elapsed = now - self._progress_started
+        if elapsed > 0:
+            self.progress['rows_per_second'] = round(
+                self.progress['rows'] / elapsed, 1)
+        self.progress['updated'] = datetime.datetime.now(pytz.UTC).isoformat()
+        self._progress_saved = now
+
+    def _save_progress(self):
+        self._update_progress_rate()
+        if self.pk is not None:
+            self.save(update_fields=['progress'])
+
+    def _execute(self, method, *args):
+        '''
+        Call `method(messages, *args)`, then record its outcome and the
+        processing time. Catches all exceptions!
+        '''
         msgs = defaultdict(list)
         try:
-            # This method must be implemented by a subclass
-            self._run_task(msgs)
+            method(msgs, *args)
             self.status = self.COMPLETE
         except Exception as err:
             msgs['error_type'] = type(err).__name__
@@ -153,8 +249,10 @@ class ImportExportTask(models.Model):
         self.data['processing_time_seconds'] = (
             datetime.datetime.now(self.date_created.tzinfo) - self.date_created
         ).total_seconds()
+        if self.progress:
+            self._update_progress_rate()
         try:
-            self.save(update_fields=['status', 'messages', 'data'])
+            self.save(update_fields=['status', 'messages', 'data', 'progress'])
         except TypeError as e:
             self.status = self.ERROR
             logging.error('Failed to save %s: %s' % (self._meta.model_name,
@@ -185,6 +283,7 @@ class ImportTask(ImportExportTask):
                 has_necessary_perm = True
 
         if 'url' in self.data:
+            self._set_phase(self.FETCH)
             self._load_assets_from_url(
                 messages=messages,
                 url=self.data.get('url'),
@@ -198,6 +297,7 @@ class ImportTask(ImportExportTask):
             # TODO: merge with `url` handling above; currently kept separate
             # because `_load_assets_from_url()` uses complex logic to deal with
             # multiple XLS files in a directory structure within a ZIP archive
+            self._set_phase(self.FETCH)
             response = requests.get(self.data['single_xls_url'])
             response.raise_for_status()
             encoded_xls = base64.b64encode(response.content)
@@ -225,9 +325,11 @@ class ImportTask(ImportExportTask):
         destination_kls = kwargs.get('destination_kls', False)
         has_necessary_perm = kwargs.get('has_necessary_perm', False)
         req = requests.get(url, allow_redirects=True)
+        self._set_phase(self.TRANSFORM)
         fif = HttpContentParse(request=req).parse()
         fif.remove_invalid_assets()
         fif.remove_empty_collections()
+        self._set_phase(self.WRITE)
 
         destination_collection = destination \
                 if (destination_kls == 'collection') else False
@@ -262,6 +364,7 @@ class ImportTask(ImportExportTask):
                             'owner__username': self.user.username,
                         })
 
+            self._record_progress(rows=1)
             if item.parent:
                 collections_to_assign.append([
                     item._orm,
@@ -285,8 +388,10 @@ class ImportTask(ImportExportTask):
         else:
             filename = ''
         library = kwargs.get('library')
+        self._set_phase(self.TRANSFORM)
         survey_dict = _b64_xls_to_dict(base64_encoded_upload)
         survey_dict_keys = survey_dict.keys()
+        self._set_phase(self.WRITE)
 
         destination = kwargs.get('destination', False)
         destination_kls = kwargs.get('destination_kls', False)
@@ -319,6 +424,7 @@ class ImportTask(ImportExportTask):
                 'kind': 'collection',
                 'owner__username': self.user.username,
             })
+            self._record_progress(rows=1)
         elif 'survey' in survey_dict_keys:
             if not destination:
                 if library and len(survey_dict.get('survey')) > 1:
@@ -346,6 +452,7 @@ class ImportTask(ImportExportTask):
                 'kind': 'asset',
                 'owner__username': self.user.username,
             })
+            self._record_progress(rows=1)
         else:
             raise SyntaxError('xls upload must have one of these sheets: {}'
                               .format('survey, library'))
@@ -396,6 +503,12 @@ class ExportTask(ImportExportTask):
              | 123                             |
 
         The default is `['hxl']`
+    * `incremental`: optional; defaults to `False`. When `true`, and a
+        previous export of the same source with the same options exists, only
+        submissions received since that export are retrieved and they are
+        appended to a copy of its result. Submissions edited or deleted since
+        the previous export are not updated. Only CSV exports are
+        incremental
     '''
 
     uid = KpiUidField(uid_prefix='e')
@@ -418,9 +531,23 @@ class ExportTask(ImportExportTask):
     }
 
     TIMESTAMP_KEY = '_submission_time'
+    # Format of `TIMESTAMP_KEY` values as stored in Mongo
+    TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+    INDEX_KEY = '_index'
+    INCREMENTAL_EXPORT_TYPES = ('csv',)
+    CSV_DIALECT = {
+        'delimiter': ';',
+        'quotechar': '"',
+        'quoting': unicodecsv.QUOTE_ALL,
+        'lineterminator': '\r\n',
+    }
     # Above 244 seems to cause 'Download error' in Chrome 64/Linux
     MAXIMUM_FILENAME_LENGTH = 240
 
+    @property
+    def _incremental(self):
+        return self.data.get('incremental', 'false').lower() == 'true'
+
     @property
     def _fields_from_all_versions(self):
         return self.data.get(
@@ -528,11 +655,19 @@ class ExportTask(ImportExportTask):
                     self.last_submission_time = timestamp
             yield submission
 
-    def _run_task(self, messages):
+    def _record_rows(self, submission_stream):
         '''
-        Generate the export and store the result in the `self.result`
-        `PrivateFileField`. Should be called by the `run()` method of the
-        superclass. The `submission_stream` method is provided for testing
+        Internal generator that yields each submission in the given
+        `submission_stream` while counting it in `self.progress`
+        '''
+        for submission in submission_stream:
+            self._record_progress(rows=1)
+            yield submission
+
+    def _get_source(self):
+        '''
+        Return the source URL, the source `Asset` and the export type after
+        checking that they can be exported by `self.user`
         '''
         source_url = self.data.get('source', False)
         if not source_url:
@@ -559,10 +694,34 @@ class ExportTask(ImportExportTask):
             raise NotImplementedError(
                 'only `xls`, `csv`, and `spss_labels` are valid export types')
 
+        return source_url, source, export_type
+
+    def _run_task(self, messages):
+        '''
+        Generate the export and store the result in the `self.result`
+        `PrivateFileField`. Should be called by the `run()` method of the
+        superclass. The `submission_stream` method is provided for testing
+        '''
+        source_url, source, export_type = self._get_source()
+
         # Take this opportunity to do some housekeeping
         self.log_and_mark_stuck_as_errored(self.user, source_url)
 
-        if isinstance(source.deployment, MockDeploymentBackend):
+        self._set_phase(self.FETCH)
+        previous_export = None
+        if self._incremental and export_type in self.INCREMENTAL_EXPORT_TYPES:
+            previous_export = self._get_previous_export(source, source_url)
+
+        if previous_export is not None:
+            # Submissions received during the same second as the newest one
+            # in the previous export may be missing from it. Retrieve them
+            # again, and drop them from the copy of the previous result
+            self.last_submission_time = previous_export.last_submission_time
+            submitted_since = self._format_timestamp(
+                previous_export.last_submission_time)
+            submission_stream = source.deployment.get_submissions(
+                submitted_since=submitted_since)
+        elif isinstance(source.deployment, MockDeploymentBackend):
             # Currently used only for unit testing (`MockDeploymentBackend`)
             # TODO: Have the KC backend also implement `_get_submissions()`?
             submission_stream = source.deployment.get_submissions()
@@ -576,6 +735,7 @@ class ExportTask(ImportExportTask):
         # recent timestamp
         submission_stream = self._record_last_submission_time(
             submission_stream)
+        submission_stream = self._record_rows(submission_stream)
 
         options = self._build_export_options(pack)
         export = pack.export(**options)
@@ -586,8 +746,16 @@ class ExportTask(ImportExportTask):
         # https://code.djangoproject.com/ticket/13809
         self.result.close()
         self.result.file.close()
+        self._set_phase(self.WRITE)
         with self.result.storage.open(self.result.name, 'wb') as output_file:
-            if export_type == 'csv':
+            if export_type != 'spss_labels':
+                output_file = _ProgressRecordingFile(output_file, self)
+            if export_type == 'csv' and previous_export is not None:
+                self._append_csv(
+                    previous_export, submitted_since,
+                    export.to_csv(submission_stream), output_file
+                )
+            elif export_type == 'csv':
                 for line in export.to_csv(submission_stream):
                     output_file.write((line + u"\r\n").encode('utf-8'))
             elif export_type == 'xls':
@@ -597,20 +765,8 @@ class ExportTask(ImportExportTask):
                         prefix='export_xlsx', mode='rb'
                 ) as xlsx_output_file:
                     export.to_xlsx(xlsx_output_file.name, submission_stream)
-                    # TODO: chunk again once
-                    # https://github.com/jschneier/django-storages/issues/449
-                    # is fixed
-                    # TODO: Check if monkey-patch (line 57) can restore writing
-                    # by chunk
-                    '''
-                    while True:
-                        chunk = xlsx_output_file.read(5 * 1024 * 1024)
-                        if chunk:
-                            output_file.write(chunk)
-                        else:
-                            break
-                    '''
-                    output_file.write(xlsx_output_file.read())
+                    self._set_phase(self.UPLOAD)
+                    self._upload_in_chunks(xlsx_output_file, output_file)
             elif export_type == 'spss_labels':
                 export.to_spss_labels(output_file)
 
@@ -622,6 +778,247 @@ class ExportTask(ImportExportTask):
         # exports in excess of the per-user, per-form limit
         self.remove_excess(self.user, source_url)
 
+    @classmethod
+    def _format_timestamp(cls, timestamp):
+        return timestamp.astimezone(pytz.UTC).strftime(cls.TIMESTAMP_FORMAT)
+
+    def _get_previous_export(self, source, source_url):
+        '''
+        Return the newest complete export by the same user of `source` with
+        the same options, or `None` if there is none or if a version of
+        `source` has been deployed since, which could change the columns
+        '''
+        options = self._get_comparable_data(self.data)
+        candidates = self._filter_by_source_kludge(
+            self._meta.model.objects.filter(
+                user=self.user,
+                status=self.COMPLETE,
+                last_submission_time__isnull=False,
+            ).exclude(pk=self.pk),
+            source_url
+        ).order_by('-date_created')
+        latest_deployed_version = source.latest_deployed_version
+        for candidate in candidates:
+            if self._get_comparable_data(candidate.data) != options or \
+                    not candidate.result:
+                continue
+            if latest_deployed_version is not None and (
+                    latest_deployed_version.date_modified >
+                    candidate.date_created):
+                return None
+            return candidate
+        return None
+
+    def _append_csv(self, previous_export, submitted_since, csv_lines,
+                    output_file):
+        '''
+        Write the data rows of `previous_export` that were submitted before
+        `submitted_since`, followed by the data rows from `csv_lines`, whose
+        `INDEX_KEY` values are shifted to follow the previous ones
+        '''
+        writer = unicodecsv.writer(
+            output_file, encoding='utf-8', **self.CSV_DIALECT)
+        with previous_export.result.storage.open(
+                previous_export.result.name, 'rb') as previous_file:
+            offset = self._copy_csv(
+                previous_file, writer, submitted_before=submitted_since)
+        # The previous export has the same headers
+        self._copy_csv(
+            (line.encode('utf-8') for line in csv_lines), writer,
+            index_offset=offset, include_headers=False
+        )
+
+    def _copy_csv(self, csv_lines, writer, index_offset=0,
+                  include_headers=True, submitted_before=None):
+        '''
+        Copy the rows of a CSV export, read from the UTF-8 encoded
+        `csv_lines`, to the CSV `writer`. `index_offset` is added to the
+        `INDEX_KEY` values, and rows submitted at or after
+        `submitted_before` are skipped. Returns the highest `INDEX_KEY`
+        value written, or `index_offset` if no data row was written
+        '''
+        reader = unicodecsv.reader(
+            csv_lines, encoding='utf-8', **self.CSV_DIALECT)
+        header = next(reader)
+        index_column = header.index(self.INDEX_KEY)
+        timestamp_column = header.index(self.TIMESTAMP_KEY)
+        if include_headers:
+            writer.writerow(header)
+        highest_index = index_offset
+        in_data = False
+        for row in reader:
+            if not in_data and not row[index_column].isdigit():
+                # Another header row, e.g. HXL tags
+                if include_headers:
+                    writer.writerow(row)
+                continue
+            in_data = True
+            if submitted_before is not None and (
+                    row[timestamp_column] >= submitted_before):
+                continue
+            index = int(row[index_column]) + index_offset
+            row[index_column] = unicode(index)
+            writer.writerow(row)
+            highest_index = max(highest_index, index)
+        return highest_index
+
+    def get_shard_ranges(self):
+        '''
+        Return the `_id` ranges, as (exclusive lower bound, inclusive upper
+        bound) tuples, of the shards to run this export in, or `None` if it
+        should run as a single task. Only large CSV exports are sharded
+        '''
+        if settings.EXPORT_SHARDS < 2 or self._incremental or \
+                self.data.get('type', '').lower() != 'csv':
+            return None
+        try:
+            source_url, source, export_type = self._get_source()
+            submission_count = source.deployment.submission_count
+            id_range = source.deployment.get_submission_id_range()
+        except Exception:
+            # Let `run()` report the problem
+            return None
+        if submission_count < settings.EXPORT_SHARDING_MIN_SUBMISSIONS or \
+                id_range is None:
+            return None
+        lowest, highest = id_range
+        span = highest - lowest + 1
+        shards = settings.EXPORT_SHARDS
+        boundaries = [lowest - 1 + span * i // shards for i in range(shards)]
+        boundaries.append(highest)
+        return zip(boundaries[:-1], boundaries[1:])
+
+    def start_sharded(self, shard_count):
+        '''
+        Mark the export as processing and initialize its progress in
+        `messages`. Returns `False` if it is already complete
+        '''
+        if not self._start():
+            return False
+        self.messages['shards'] = {'total': shard_count, 'complete': 0}
+        self.save(update_fields=['messages'])
+        return True
+
+    def _get_shard_name(self, shard):
+        return posixpath.join(
+            self.user.username, 'exports', 'parts',
+            '{}-{}.csv'.format(self.uid, shard)
+        )
+
+    def run_shard(self, shard, start, end):
+        '''
+        Export the submissions whose `_id` is greater than `start` and no
+        greater than `end` as a CSV part in storage. Returns the name of the
+        part and the most recent submission time it contains
+        '''
+        source_url, source, export_type = self._get_source()
+        submission_stream = source.deployment.get_submissions(
+            start_after=start, end_at=end)
+        pack, submission_stream = build_formpack(
+            source, submission_stream, self._fields_from_all_versions)
+        submission_stream = self._record_last_submission_time(
+            submission_stream)
+        export = pack.export(**self._build_export_options(pack))
+
+        storage = self.result.storage
+        name = self._get_shard_name(shard)
+        # Leftover from a failed attempt
+        if storage.exists(name):
+            storage.delete(name)
+        name = storage.save(name, ContentFile(''))
+        with storage.open(name, 'wb') as part_file:
+            for line in export.to_csv(submission_stream):
+                part_file.write((line + u"\r\n").encode('utf-8'))
+
+        if self.last_submission_time is None:
+            last_submission_time = None
+        else:
+            last_submission_time = self.last_submission_time.isoformat()
+        return {'name': name, 'last_submission_time': last_submission_time}
+
+    @classmethod
+    def record_shard_complete(cls, uid):
+        with transaction.atomic():
+            export_task = cls.objects.select_for_update().get(uid=uid)
+            export_task.messages['shards']['complete'] += 1
+            export_task.save(update_fields=['messages'])
+
+    @classmethod
+    def record_shard_failure(cls, uid, shard, error):
+        '''
+        Mark the export as failed because `shard` raised `error` on its last
+        attempt, and delete the parts of the other shards
+        '''
+        with transaction.atomic():
+            export_task = cls.objects.select_for_update().get(uid=uid)
+            export_task.status = cls.ERROR
+            export_task.messages['error_type'] = type(error).__name__
+            export_task.messages['error'] = u'shard {}: {}'.format(
+                shard, error)
+            export_task.save(update_fields=['status', 'messages'])
+        storage = export_task.result.storage
+        for other_shard in range(export_task.messages['shards']['total']):
+            name = export_task._get_shard_name(other_shard)
+            if storage.exists(name):
+                storage.delete(name)
+
+    def finish_sharded(self, parts):
+        '''
+        Stitch the CSV `parts` returned by `run_shard()`, in shard order,
+        into the result of this export. Suitable to be called by an
+        asynchronous task runner (Celery)
+        '''
+        self._execute(self._stitch_shards, parts)
+
+    def _stitch_shards(self, messages, parts):
+        source_url, source, export_type = self._get_source()
+        # Only needed to build the file name
+        pack, _ = build_formpack(
+            source, [], self._fields_from_all_versions)
+        export = pack.export(**self._build_export_options(pack))
+        filename = self._build_export_filename(export, export_type)
+        self.result.save(filename, ContentFile(''))
+        self.result.close()
+        self.result.file.close()
+
+        storage = self.result.storage
+        offset = 0
+        self._set_phase(self.TRANSFORM)
+        with storage.open(self.result.name, 'wb') as output_file:
+            output_file = _ProgressRecordingFile(output_file, self)
+            writer = unicodecsv.writer(
+                output_file, encoding='utf-8', **self.CSV_DIALECT)
+            for shard, part in enumerate(parts):
+                # Each part numbers its rows from 1
+                with storage.open(part['name'], 'rb') as part_file:
+                    offset = self._copy_csv(
+                        part_file, writer, index_offset=offset,
+                        include_headers=(shard == 0)
+                    )
+        for part in parts:
+            storage.delete(part['name'])
+
+        last_submission_times = [
+            dateutil.parser.parse(part['last_submission_time'])
+            for part in parts if part['last_submission_time']
+        ]
+        if last_submission_times:
+            self.last_submission_time = max(last_submission_times)
+        self.result.open('rb')
+        self.save(update_fields=['last_submission_time'])
+        self.remove_excess(self.user, source_url)
+
+    @staticmethod
+    def _upload_in_chunks(source_file, output_file):
+        '''
+        Copy `source_file` to the storage file `output_file` while holding at
+        most `settings.EXPORT_UPLOAD_CHUNK_SIZE` bytes of it in memory. The S3
+        storage file uploads what it receives as parts of a multipart upload
+        (see the `_flush_write_buffer()` patch above)
+        '''
+        shutil.copyfileobj(
+            source_file, output_file, settings.EXPORT_UPLOAD_CHUNK_SIZE)
+
     @staticmethod
     def _filter_by_source_kludge(queryset, source):
         '''
@@ -630,6 +1027,55 @@ class ExportTask(ImportExportTask):
         '''
         return queryset.filter(data__contains=source)
 
+    @staticmethod
+    def _get_comparable_data(data):
+        '''
+        Return a copy of `data` without the keys that do not affect the
+        result of an export: whether it is `incremental` and the diagnostic
+        information added by `run()`
+        '''
+        data = dict(data)
+        data.pop('incremental', None)
+        data.pop('processing_time_seconds', None)
+        return data
+
+    @classmethod
+    def get_reusable(cls, user, data, source):
+        '''
+        Return an export by `user` with exactly the same `data` that is either
+        still running, or complete and up to date, i.e. created after the
+        latest deployment of `source` and after its latest submission. Return
+        `None` if there is no such export.
+
+        `source` is the `Asset` specified by the source URL in `data`.
+        '''
+        # Never coalesce onto an export that will not complete
+        cls.log_and_mark_stuck_as_errored(user, data['source'])
+        candidates = cls._filter_by_source_kludge(
+            cls.objects.filter(user=user).exclude(status=cls.ERROR),
+            data['source']
+        ).order_by('-date_created')
+        latest_deployed_version = source.latest_deployed_version
+        data = cls._get_comparable_data(data)
+        for candidate in candidates:
+            if cls._get_comparable_data(candidate.data) != data:
+                continue
+            if latest_deployed_version is not None and (
+                    latest_deployed_version.date_modified >
+                    candidate.date_created):
+                # This export, and any older one, predates the deployment
+                return None
+            if candidate.status != cls.COMPLETE:
+                return candidate
+            last_submission_time = source.deployment.last_submission_time
+            if candidate.result and (
+                    last_submission_time is None or
+                    last_submission_time < candidate.date_created):
+                return candidate
+            # Older exports are no more up to date than this one
+            return None
+        return None
+
     @classmethod
     @transaction.atomic
     def log_and_mark_stuck_as_errored(cls, user, source):
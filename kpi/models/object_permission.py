@@ -32,6 +32,97 @@ def perm_parse(perm, obj=None):
         codename = perm
     return app_label, codename
 
+# Incremented every time `ObjectPermission` records are written, which
+# discards the effective permissions memoized on model instances
+_perm_cache_generation = 0
+
+# `Permission`s are only created by migrations, so their primary keys can be
+# memoized for the life of the process. Keys are `ContentType` primary keys;
+# values are dictionaries of {codename: permission pk}
+_permission_pks_by_content_type = {}
+
+
+def invalidate_perms_cache():
+    ''' Discard all effective permissions memoized by
+    `ObjectPermissionMixin`. Must be called after writing `ObjectPermission`
+    records '''
+    global _perm_cache_generation
+    _perm_cache_generation += 1
+
+
+def get_permission_pks(content_type, refresh=False):
+    ''' Return a dictionary of {codename: pk} for every `Permission` that
+    belongs to `content_type`. Results are memoized per process '''
+    if not refresh:
+        try:
+            return _permission_pks_by_content_type[content_type.pk]
+        except KeyError:
+            pass
+    permission_pks = dict(Permission.objects.filter(
+        content_type=content_type).values_list('codename', 'pk'))
+    _permission_pks_by_content_type[content_type.pk] = permission_pks
+    return permission_pks
+
+
+def get_permission_pk(content_type, codename):
+    ''' Return the primary key of the `Permission` for `codename`, or `None`
+    if no such permission exists for `content_type` '''
+    try:
+        return get_permission_pks(content_type)[codename]
+    except KeyError:
+        # Perhaps the permission was created after we memoized the others
+        return get_permission_pks(content_type, refresh=True).get(codename)
+
+
+def prefetch_perms(objects):
+    ''' Load the `ObjectPermission` records of every object in `objects`
+    with a single query per content type, and memoize them on each instance so
+    that subsequent calls to `has_perm()`, `get_perms()`, etc. do not query
+    the database. `objects` may contain a mix of `ObjectPermissionMixin`
+    models '''
+    objects_by_content_type = defaultdict(list)
+    for obj in objects:
+        content_type = ContentType.objects.get_for_model(obj)
+        objects_by_content_type[content_type].append(obj)
+    for content_type, ct_objects in objects_by_content_type.iteritems():
+        generation = _perm_cache_generation
+        rows_by_object_id = defaultdict(list)
+        for object_id, user_id, permission_id, deny in \
+                ObjectPermission.objects.filter(
+                    content_type=content_type,
+                    object_id__in=[obj.pk for obj in ct_objects]
+                ).values_list('object_id', 'user_id', 'permission_id', 'deny'):
+            rows_by_object_id[object_id].append((user_id, permission_id, deny))
+        for obj in ct_objects:
+            obj._perm_rows_cache = (generation, rows_by_object_id[obj.pk])
+    return objects
+
+
+def get_perms_map(user_obj, objects):
+    ''' Return a dictionary of {object pk: set of codenames} holding every
+    permission that `user_obj` effectively has on each of `objects`, including
+    those granted to the public. Results agree with `has_perm()`, but the
+    whole batch costs a constant number of queries. All `objects` must be
+    instances of the same model, since their primary keys are used as keys
+    '''
+    if isinstance(user_obj, AnonymousUser):
+        # Get the User database representation for AnonymousUser
+        user_obj = get_anonymous_user()
+    objects = list(objects)
+    if not user_obj.is_active:
+        # Inactive users are denied everything by `ObjectPermissionBackend`
+        return {obj.pk: set() for obj in objects}
+    # Only load permissions for objects that have nothing memoized
+    prefetch_perms([
+        obj for obj in objects
+            if getattr(obj, '_perm_rows_cache', (None,))[0] !=
+                _perm_cache_generation
+    ])
+    return {
+        obj.pk: obj._get_effective_codenames(user_obj) for obj in objects
+    }
+
+
 def get_all_objects_for_user(user, klass):
     ''' Return all objects of type klass to which user has been assigned any
     permission. '''
@@ -40,7 +131,7 @@ def get_all_objects_for_user(user, klass):
         content_type=ContentType.objects.get_for_model(klass)
     ).values_list('object_id', flat=True))
 
-def get_objects_for_user(user, perms, klass=None):
+def get_objects_for_user(user, perms, klass=None, include_public=False):
     """
     A simplified version of django-guardian's get_objects_for_user shortcut.
     Returns queryset of objects for which a given ``user`` has *all*
@@ -55,6 +146,8 @@ def get_objects_for_user(user, perms, klass=None):
       the same or ``ValidationError`` exception will be raised.
     :param klass: may be a Model, Manager or QuerySet object. If not given
       this parameter will be computed based on given ``params``.
+    :param include_public: when ``True``, also return objects on which the
+      permissions are granted to the anonymous user, in the same query.
     """
     if isinstance(perms, basestring):
         perms = [perms]
@@ -106,22 +199,23 @@ def get_objects_for_user(user, perms, klass=None):
     # queries, and it's nice to be able to pass in request.user blindly.
     if user.is_anonymous():
         user = get_anonymous_user()
+    user_ids = [user.pk]
+    if include_public and user.pk != settings.ANONYMOUS_USER_ID:
+        user_ids.append(settings.ANONYMOUS_USER_ID)
 
-    # Now we should extract list of pk values for which we would filter queryset
-    user_obj_perms_queryset = (ObjectPermission.objects
-        .filter(user=user)
-        .filter(permission__content_type=ctype)
-        .filter(permission__codename__in=codenames)
-        .filter(deny=False))
-
-    if len(codenames) > 1:
-        counts = user_obj_perms_queryset.values('object_id').annotate(
-            object_pk_count=models.Count('object_id'))
-        user_obj_perms_queryset = counts.filter(object_pk_count__gte=len(codenames))
-
-    values = user_obj_perms_queryset.values_list('object_id', flat=True)
-    values = list(values)
-    objects = queryset.filter(pk__in=values)
+    # Inherited grants are stored as `ObjectPermission` records of their own,
+    # so each permission can be checked with a subquery that is satisfied by
+    # the (user, permission, deny, inherited, object_id, content_type) unique
+    # index. Requiring *all* permissions means one subquery per codename. This
+    # avoids sending a list of every matching primary key back to the database
+    objects = queryset
+    for codename in codenames:
+        objects = objects.filter(pk__in=ObjectPermission.objects.filter(
+            user_id__in=user_ids,
+            permission_id=get_permission_pk(ctype, codename),
+            content_type=ctype,
+            deny=False,
+        ).values('object_id'))
 
     return objects
 
@@ -233,6 +327,15 @@ class ObjectPermissionMixin(object):
     e.g.
         class MyAwesomeModel(ObjectPermissionMixin, models.Model)
     '''
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ObjectPermissionMixin, cls).from_db(
+            db, field_names, values)
+        # Rows of `prefetch_related('permissions')` are loaded along with the
+        # instance. Remember how fresh they are, see `_get_perm_rows()`
+        instance._perm_prefetch_generation = _perm_cache_generation
+        return instance
+
     def get_assignable_permissions(self):
         ''' The "versioned app registry" used during migrations apparently does
         not store non-database attributes, so this awful workaround is needed
@@ -258,6 +361,7 @@ class ObjectPermissionMixin(object):
         if type(source_object) is type(self):
             # First delete all permissions of the target asset.
             self.permissions.all().delete()
+            invalidate_perms_cache()
             # Then copy all permissions from source to target asset
             source_permissions = list(source_object.permissions.all())
             for source_permission in source_permissions:
@@ -293,9 +397,11 @@ class ObjectPermissionMixin(object):
             app_label, codename = perm_parse(perm)
             if app_label == content_type.app_label:
                 codenames.add(codename)
-        allowed_permissions = Permission.objects.filter(
-            content_type=content_type, codename__in=codenames
-        ).values_list('pk', flat=True)
+        permission_pks = get_permission_pks(content_type)
+        allowed_permissions = set(
+            permission_pks[codename] for codename in codenames
+                if codename in permission_pks
+        )
         filtered_set = copy.copy(unfiltered_set)
         for user_id, permission_id in unfiltered_set:
             if user_id == settings.ANONYMOUS_USER_ID:
@@ -303,28 +409,63 @@ class ObjectPermissionMixin(object):
                     filtered_set.remove((user_id, permission_id))
         return filtered_set
 
+    def _get_perm_rows(self):
+        ''' Return a list of (user_id, permission_id, deny) tuples for every
+        `ObjectPermission` assigned to this object. The list is memoized on
+        the instance until `invalidate_perms_cache()` is called '''
+        try:
+            generation, rows = self._perm_rows_cache
+        except AttributeError:
+            # Reuse the results of `prefetch_related('permissions')`, e.g. from
+            # `optimize_queryset_for_list()`, unless permissions have been
+            # written since they were loaded
+            try:
+                prefetched = self._prefetched_objects_cache['permissions']
+                generation = self._perm_prefetch_generation
+            except (AttributeError, KeyError):
+                pass
+            else:
+                rows = [(p.user_id, p.permission_id, p.deny)
+                        for p in prefetched]
+                self._perm_rows_cache = (generation, rows)
+                if generation == _perm_cache_generation:
+                    return rows
+        else:
+            if generation == _perm_cache_generation:
+                return rows
+        generation = _perm_cache_generation
+        rows = list(ObjectPermission.objects.filter_for_object(self).values_list(
+            'user_id', 'permission_id', 'deny'))
+        self._perm_rows_cache = (generation, rows)
+        return rows
+
     def _get_effective_perms(
         self, user=None, codename=None, include_calculated=True
     ):
         ''' Reconcile all grant and deny permissions, and return an
         authoritative set of grant permissions (i.e. deny=False) for the
         current object. '''
-        # Including calculated permissions means we can't just pass kwargs
-        # through to filter(), but we'll map the ones we understand.
-        kwargs = {}
-        if user is not None:
-            kwargs['user'] = user
+        content_type = ContentType.objects.get_for_model(self)
+        user_id = None if user is None else user.pk
+        permission_id = None
         if codename is not None:
             # share_ requires loading change_ from the database
             if codename.startswith('share_'):
-                kwargs['permission__codename'] = re.sub(
-                    '^share_', 'change_', codename, 1)
+                stored_codename = re.sub('^share_', 'change_', codename, 1)
+            else:
+                stored_codename = codename
+            permission_id = get_permission_pk(content_type, stored_codename)
+        grant_perms = set()
+        deny_perms = set()
+        for row_user_id, row_permission_id, deny in self._get_perm_rows():
+            if user_id is not None and row_user_id != user_id:
+                continue
+            if codename is not None and row_permission_id != permission_id:
+                continue
+            if deny:
+                deny_perms.add((row_user_id, row_permission_id))
             else:
-                kwargs['permission__codename'] = codename
-        grant_perms = set(ObjectPermission.objects.filter_for_object(self,
-            deny=False, **kwargs).values_list('user_id', 'permission_id'))
-        deny_perms = set(ObjectPermission.objects.filter_for_object(self,
-            deny=True, **kwargs).values_list('user_id', 'permission_id'))
+                grant_perms.add((row_user_id, row_permission_id))
         effective_perms = grant_perms.difference(deny_perms)
         # Sometimes only the explicitly assigned permissions are wanted,
         # e.g. when calculating inherited permissions
@@ -339,7 +480,7 @@ class ObjectPermissionMixin(object):
                 return effective_perms
 
         # Add on the calculated permissions
-        content_type = ContentType.objects.get_for_model(self)
+        permission_pks = get_permission_pks(content_type)
         if codename in self.CALCULATED_PERMISSIONS:
             # A sepecific query for a calculated permission should not return
             # any explicitly assigned permissions, e.g. share_ should not
@@ -352,13 +493,11 @@ class ObjectPermissionMixin(object):
                 codename is None or codename.startswith('share_')
         ):
             # Everyone with change_ should also get share_
-            change_permissions = Permission.objects.filter(
-                content_type=content_type,
-                codename__startswith='change_'
-            )
-            for change_permission in change_permissions:
+            for change_codename, change_pk in permission_pks.iteritems():
+                if not change_codename.startswith('change_'):
+                    continue
                 share_permission_codename = re.sub(
-                    '^change_', 'share_', change_permission.codename, 1)
+                    '^change_', 'share_', change_codename, 1)
                 if (codename is not None and
                         share_permission_codename != codename
                 ):
@@ -366,31 +505,30 @@ class ObjectPermissionMixin(object):
                     # doesn't match exactly. Necessary because `Asset` has
                     # `*_submissions` in addition to `*_asset`
                     continue
-                share_permission = Permission.objects.get(
-                    content_type=content_type,
-                    codename=share_permission_codename
-                )
-                for user_id, permission_id in effective_perms_copy:
-                    if permission_id == change_permission.pk:
-                        effective_perms.add((user_id, share_permission.pk))
-        # The owner has the delete_ permission
-        if self.owner is not None and (
-                user is None or user.pk == self.owner.pk) and (
+                share_pk = get_permission_pk(
+                    content_type, share_permission_codename)
+                if share_pk is None:
+                    raise Permission.DoesNotExist(share_permission_codename)
+                for perm_user_id, perm_id in effective_perms_copy:
+                    if perm_id == change_pk:
+                        effective_perms.add((perm_user_id, share_pk))
+        # The owner has the delete_ permission. Compare `owner_id` to avoid
+        # fetching the owner from the database
+        if self.owner_id is not None and (
+                user is None or user.pk == self.owner_id) and (
                 codename is None or codename.startswith('delete_')
         ):
-            delete_permissions = Permission.objects.filter(
-                content_type=content_type,
-                codename__startswith='delete_'
-            )
-            for delete_permission in delete_permissions:
+            for delete_codename, delete_pk in permission_pks.iteritems():
+                if not delete_codename.startswith('delete_'):
+                    continue
                 if (codename is not None and
-                        delete_permission.codename != codename
+                        delete_codename != codename
                 ):
                     # If the caller specified `codename`, skip anything that
                     # doesn't match exactly. Necessary because `Asset` has
                     # `delete_submissions` in addition to `delete_asset`
                     continue
-                effective_perms.add((self.owner.pk, delete_permission.pk))
+                effective_perms.add((self.owner_id, delete_pk))
         # We may have calculated more permissions for anonymous users
         # than they are allowed to have. Remove them.
         if user is None or user.pk == settings.ANONYMOUS_USER_ID:
@@ -399,176 +537,211 @@ class ObjectPermissionMixin(object):
             # Anonymous users weren't considered; no filtering is necessary
             return effective_perms
 
-    def recalculate_descendants_perms(self):
+    def recalculate_descendants_perms(
+            self, progress_callback=None, in_background=False):
         ''' Recalculate the inherited permissions of all descendants. Expects
-        either self.get_mixed_children() or self.get_children() to exist. The
-        former will be used preferentially if it exists. '''
-
-        GET_CHILDREN_METHODS = ('get_mixed_children', 'get_children')
-        can_have_children = False
-        for method in GET_CHILDREN_METHODS:
-            if hasattr(self, method):
-                can_have_children = True
-                break
-        if not can_have_children:
+        self.get_mixed_descendants() to exist; otherwise, it's impossible for
+        us to have descendants.
+
+        The whole subtree is loaded, recalculated in memory from the top down,
+        and written back with a constant number of queries, regardless of the
+        size and depth of the tree.
+        :param progress_callback: Optional callable that receives the number
+            of descendants written so far and the total number of descendants
+        :param in_background bool: When `True`, queue a Celery task to do the
+            work instead. Only use this outside of a transaction, e.g. after
+            calling `assign_perm(..., defer_recalc=True)`, so that the task
+            sees the committed permissions
+        '''
+        if not hasattr(self, 'get_mixed_descendants'):
             # It's impossible for us to have descendants. Move along...
             return
 
-        # Any potential parents found will be appended to this list
-        parents = [self]
-        while True:
-            try:
-                parent = parents.pop()
-            except IndexError:
-                # No parents left; we're done!
-                break
-            # Get the effective permissions once per parent so that each child
-            # does not have to query the database for the same information
-            parent_effective_perms = parent._get_effective_perms(
+        if in_background:
+            # Avoid a circular import
+            from kpi.tasks import recalculate_descendants_perms_in_background
+            recalculate_descendants_perms_in_background.delay(
+                ContentType.objects.get_for_model(self).pk, self.pk)
+            return
+
+        # Retrieve only the necessary fields from the database. NB: `content`
+        # is particularly heavy. Each queryset must list parents before their
+        # children
+        descendant_querysets = [
+            queryset.only('pk', 'owner', 'parent')
+                for queryset in self.get_mixed_descendants()
+        ]
+        descendants = []
+        for queryset in descendant_querysets:
+            descendants.extend(queryset)
+        if not descendants:
+            return
+
+        # Load the explicitly assigned permissions of every descendant that
+        # could have children of its own, with one query per content type
+        explicit_perms = defaultdict(list)
+        for queryset in descendant_querysets:
+            if not hasattr(queryset.model, 'get_mixed_descendants'):
+                # Only used to calculate the permissions of children
+                continue
+            content_type = ContentType.objects.get_for_model(queryset.model)
+            for object_id, user_id, permission_id, deny in \
+                    ObjectPermission.objects.filter(
+                        content_type=content_type,
+                        object_id__in=queryset.values('pk'),
+                        inherited=False,
+                    ).values_list(
+                        'object_id', 'user_id', 'permission_id', 'deny'):
+                explicit_perms[(content_type.pk, object_id)].append(
+                    (user_id, permission_id, deny))
+
+        # Walk the subtree from the top down, calculating the effective
+        # permissions of every descendant that could have children of its own
+        self_content_type = ContentType.objects.get_for_model(self)
+        effective_perms = {
+            (self_content_type.pk, self.pk): self._get_effective_perms(
                 include_calculated=False)
-            # Get all children, retrieving only the necessary fields from the
-            # database. NB: `content` is particularly heavy
-            for method in GET_CHILDREN_METHODS:
-                if hasattr(parent, method):
-                    break
-            children = getattr(parent, method)().only(
-                'pk', 'owner', 'parent')
-            # Delete stale permissions once per parent, instead of per-child
-            # TODO: Um, don't have two loops?
-            delete_pks_by_content_type = {}
-            for child in children:
-                content_type = ContentType.objects.get_for_model(child).pk
-                pk_list = delete_pks_by_content_type.get(content_type, [])
-                pk_list.append(child.pk)
-                delete_pks_by_content_type[content_type] = pk_list
-            delete_query = models.Q()
-            for content_type, pks in delete_pks_by_content_type.iteritems():
-                delete_query |= models.Q(
+        }
+        new_perms_by_descendant = []
+        for descendant in descendants:
+            content_type = ContentType.objects.get_for_model(descendant)
+            parent_content_type = ContentType.objects.get_for_model(
+                descendant._meta.get_field('parent').related_model)
+            inherited_perms = descendant._get_inherited_perms(
+                effective_perms[(parent_content_type.pk, descendant.parent_id)]
+            )
+            new_perms_by_descendant.append([
+                ObjectPermission(
                     content_type=content_type,
-                    object_id__in=pks
-                )
-            # filter(Q()) is like all(); make sure we don't delete with a query
-            # like that just because there are no children!
-            if len(delete_pks_by_content_type):
-                # This doesn't run as a single DELETE query. For once, MySQL
-                # wins? https://code.djangoproject.com/ticket/23576#comment:3
-                # TODO: Verify this is faster than having children delete
-                ObjectPermission.objects.filter(
-                    delete_query, inherited=True).delete()
-            # Process each child individually, but only write to the database
-            # once per parent
-            objects_to_create = []
-            for child in children:
-                for method in GET_CHILDREN_METHODS:
-                    if hasattr(child, method):
-                        # This child could have its own children; make sure we
-                        # check it later
-                        parents.append(child)
-                        break
-                # Recalculate the child's permissions
-                new_permissions = child._recalculate_inherited_perms(
-                    parent_effective_perms=parent_effective_perms,
-                    stale_already_deleted=True,
-                    return_instead_of_creating=True
-                )
-                objects_to_create += new_permissions
-            ObjectPermission.objects.bulk_create(objects_to_create)
+                    object_id=descendant.pk,
+                    user_id=user_id,
+                    permission_id=permission_id,
+                    inherited=True,
+                    uid=ObjectPermission._meta.get_field(
+                        'uid').generate_uid(),
+                ) for user_id, permission_id in inherited_perms
+            ])
+            if hasattr(descendant, 'get_mixed_descendants'):
+                # This descendant could have children of its own
+                grant_perms = set(inherited_perms)
+                deny_perms = set()
+                for user_id, permission_id, deny in explicit_perms[
+                        (content_type.pk, descendant.pk)]:
+                    if deny:
+                        deny_perms.add((user_id, permission_id))
+                    else:
+                        grant_perms.add((user_id, permission_id))
+                effective_perms[(content_type.pk, descendant.pk)] = \
+                    descendant._filter_anonymous_perms(
+                        grant_perms.difference(deny_perms))
 
-    def _recalculate_inherited_perms(
-            self,
-            parent_effective_perms=None,
-            stale_already_deleted=False,
-            return_instead_of_creating=False,
-            translate_perm={} # mutable default parameter serves as cache
-    ):
-        ''' Copy all of our parent's effective permissions to ourself,
-        marking the copies as inherited permissions. The owner's rights are
-        also made explicit as "inherited" permissions. '''
-        # Start with a clean slate
-        if not stale_already_deleted:
-            ObjectPermission.objects.filter_for_object(
-                self,
-                inherited=True
+        # Delete all stale permissions with one query per content type, then
+        # write the new ones in batches of descendants
+        for queryset in descendant_querysets:
+            ObjectPermission.objects.filter(
+                content_type=ContentType.objects.get_for_model(queryset.model),
+                object_id__in=queryset.values('pk'),
+                inherited=True,
             ).delete()
+        total = len(descendants)
+        batch_size = settings.PERMISSION_RECALCULATION_BATCH_SIZE
+        for start in range(0, total, batch_size):
+            batch = new_perms_by_descendant[start:start + batch_size]
+            ObjectPermission.objects.bulk_create(
+                [perm for perms in batch for perm in perms])
+            if progress_callback is not None:
+                progress_callback(start + len(batch), total)
+        invalidate_perms_cache()
+
+    def _get_inherited_perms(self, parent_effective_perms):
+        ''' Return a list of (user_id, permission_id) tuples for all the
+        permissions that this object should inherit. The owner gets every
+        assignable permission, and every other user gets our parent's
+        effective permissions, translated by MAPPED_PARENT_PERMISSIONS if the
+        parent is a different model '''
         content_type = ContentType.objects.get_for_model(self)
-        if return_instead_of_creating:
-            # Conditionally create this so that Python will raise an exception
-            # if we use it when we're not supposed to
-            objects_to_return = []
+        inherited_perms = []
         # The owner gets every assignable permission
-        if self.owner is not None:
-            for perm in Permission.objects.filter(
-                content_type=content_type,
-                codename__in=self.get_assignable_permissions()
-            ):
-                new_permission = ObjectPermission()
-                new_permission.content_object = self
-                # `user_id` instead of `user` is another workaround for
-                # migrations
-                new_permission.user_id = self.owner_id
-                new_permission.permission = perm
-                new_permission.inherited = True
-                new_permission.uid = new_permission._meta.get_field(
-                    'uid').generate_uid()
-                if return_instead_of_creating:
-                    objects_to_return.append(new_permission)
-                else:
-                    new_permission.save()
+        if self.owner_id is not None:
+            for codename in self.get_assignable_permissions():
+                permission_id = get_permission_pk(content_type, codename)
+                if permission_id is None:
+                    # The permission does not exist (yet); skip it
+                    continue
+                inherited_perms.append((self.owner_id, permission_id))
         # Is there anything to inherit?
-        if self.parent is not None:
-            # Get our parent's effective permissions from the database if they
-            # were not passed in as an argument
-            if parent_effective_perms is None:
+        if self.parent_id is None:
+            return inherited_perms
+        parent_content_type = ContentType.objects.get_for_model(
+            self._meta.get_field('parent').related_model)
+        translate_perm = None
+        if hasattr(self, 'MAPPED_PARENT_PERMISSIONS'):
+            translate_perm = {}
+            for parent_codename, parent_pk in get_permission_pks(
+                    parent_content_type).iteritems():
+                try:
+                    translated_codename = self.MAPPED_PARENT_PERMISSIONS[
+                        parent_codename]
+                except KeyError:
+                    # We haven't been configured to inherit this permission
+                    # from our parent, so skip it
+                    continue
+                translate_perm[parent_pk] = get_permission_pk(
+                    content_type, translated_codename)
+        elif content_type != parent_content_type:
+            raise ImproperlyConfigured(
+                'Parent of {} is a {}, but the child has not defined '
+                'MAPPED_PARENT_PERMISSIONS.'.format(
+                    type(self), parent_content_type.model_class())
+            )
+        # All our parent's effective permissions become our inherited
+        # permissions
+        for user_id, permission_id in parent_effective_perms:
+            if user_id == self.owner_id:
+                # The owner already has every assignable permission
+                continue
+            if translate_perm is not None:
+                permission_id = translate_perm.get(permission_id)
+                if permission_id is None:
+                    continue
+            inherited_perms.append((user_id, permission_id))
+        return inherited_perms
+
+    def _recalculate_inherited_perms(self, parent_effective_perms=None):
+        ''' Copy all of our parent's effective permissions to ourself,
+        marking the copies as inherited permissions. The owner's rights are
+        also made explicit as "inherited" permissions. '''
+        # Start with a clean slate
+        ObjectPermission.objects.filter_for_object(
+            self,
+            inherited=True
+        ).delete()
+        invalidate_perms_cache()
+        # Get our parent's effective permissions from the database if they
+        # were not passed in as an argument
+        if parent_effective_perms is None:
+            if self.parent_id is None:
+                parent_effective_perms = set()
+            else:
                 parent_effective_perms = self.parent._get_effective_perms(
                     include_calculated=False)
-            # All our parent's effective permissions become our inherited
-            # permissions. Store translations in the translate_perm dictionary
-            # to minimize invocations of the Django machinery
-            for user_id, permission_id in parent_effective_perms:
-                if user_id == self.owner_id:
-                    # The owner already has every assignable permission
-                    continue
-                if hasattr(self, 'MAPPED_PARENT_PERMISSIONS'):
-                    try:
-                        translated_id = translate_perm[permission_id]
-                    except KeyError:
-                        parent_perm = Permission.objects.get(pk=permission_id)
-                        try:
-                            translated_codename = \
-                                self.MAPPED_PARENT_PERMISSIONS[
-                                    parent_perm.codename]
-                        except KeyError:
-                            # We haven't been configured to inherit this
-                            # permission from our parent, so skip it
-                            continue
-                        translated_id = Permission.objects.get(
-                            content_type__app_label=\
-                                parent_perm.content_type.app_label,
-                            codename=translated_codename
-                        ).pk
-                        translate_perm[permission_id] = translated_id
-                    permission_id = translated_id
-                elif content_type != ContentType.objects.get_for_model(
-                        self.parent
-                ):
-                    raise ImproperlyConfigured(
-                        'Parent of {} is a {}, but the child has not defined '
-                        'MAPPED_PARENT_PERMISSIONS.'.format(
-                            type(self), type(self.parent))
-                    )
-                new_permission = ObjectPermission()
-                new_permission.content_object = self
-                new_permission.user_id = user_id
-                new_permission.permission_id = permission_id
-                new_permission.inherited = True
-                new_permission.uid = new_permission._meta.get_field(
-                    'uid').generate_uid()
-                if return_instead_of_creating:
-                    objects_to_return.append(new_permission)
-                else:
-                    new_permission.save()
-        if return_instead_of_creating:
-            return objects_to_return
+        content_type = ContentType.objects.get_for_model(self)
+        objects_to_create = []
+        for user_id, permission_id in self._get_inherited_perms(
+                parent_effective_perms):
+            new_permission = ObjectPermission()
+            new_permission.content_type = content_type
+            new_permission.object_id = self.pk
+            # `user_id` instead of `user` is another workaround for
+            # migrations
+            new_permission.user_id = user_id
+            new_permission.permission_id = permission_id
+            new_permission.inherited = True
+            new_permission.uid = new_permission._meta.get_field(
+                'uid').generate_uid()
+            objects_to_create.append(new_permission)
+        ObjectPermission.objects.bulk_create(objects_to_create)
+        invalidate_perms_cache()
 
     def _get_implied_perms(self, explicit_perm, reverse=False):
         """ Determine which permissions are implied by `explicit_perm` based on
@@ -677,6 +850,7 @@ class ObjectPermissionMixin(object):
             deny=deny,
             inherited=False
         )
+        invalidate_perms_cache()
         # Assign any applicable KC permissions
         if not deny and not skip_kc:
             assign_applicable_kc_permissions(self, user_obj, codename)
@@ -700,9 +874,35 @@ class ObjectPermissionMixin(object):
         ''' Return a list of codenames of all effective grant permissions that
         user_obj has on this object. '''
         user_perm_ids = self._get_effective_perms(user=user_obj)
-        perm_ids = [x[1] for x in user_perm_ids]
-        return Permission.objects.filter(pk__in=perm_ids).values_list(
-            'codename', flat=True)
+        perm_ids = set(x[1] for x in user_perm_ids)
+        content_type = ContentType.objects.get_for_model(self)
+        return [codename for codename, pk in get_permission_pks(
+            content_type).iteritems() if pk in perm_ids]
+
+    def _get_effective_codenames(self, user_obj):
+        ''' Return the set of codenames of all permissions that `user_obj`,
+        which must be a real `User`, has on this object, either directly or
+        because they are granted to the public '''
+        content_type = ContentType.objects.get_for_model(self)
+        permission_pks = get_permission_pks(content_type)
+        if user_obj.is_superuser:
+            # Treat superusers the way django.contrib.auth does
+            return set(permission_pks.keys())
+        codenames_by_pk = {pk: codename for codename, pk in
+            permission_pks.iteritems()}
+        codenames = set(
+            codenames_by_pk[perm_id] for user_id, perm_id in
+                self._get_effective_perms(user=user_obj)
+        )
+        if user_obj.pk != settings.ANONYMOUS_USER_ID:
+            # Add on whatever the public has access to. Anonymous permissions
+            # are already restricted to ALLOWED_ANONYMOUS_PERMISSIONS
+            codenames.update(
+                codenames_by_pk[perm_id] for user_id, perm_id in
+                    self._get_effective_perms(
+                        user=User(pk=settings.ANONYMOUS_USER_ID))
+            )
+        return codenames
 
     def get_users_with_perms(self, attach_perms=False):
         ''' Return a QuerySet of all users with any effective grant permission
@@ -710,10 +910,13 @@ class ObjectPermissionMixin(object):
         users as the keys and lists of their permissions as the values. '''
         user_perm_ids = self._get_effective_perms()
         if attach_perms:
+            content_type = ContentType.objects.get_for_model(self)
+            codenames_by_pk = {pk: codename for codename, pk in
+                get_permission_pks(content_type).iteritems()}
             user_perm_dict = {}
             for user_id, perm_id in user_perm_ids:
                 perm_list = user_perm_dict.get(user_id, [])
-                perm_list.append(Permission.objects.get(pk=perm_id).codename)
+                perm_list.append(codenames_by_pk[perm_id])
                 user_perm_dict[user_id] = perm_list
             # Resolve user ids into actual user objects
             user_perm_dict = {User.objects.get(pk=key): value for (key, value)
@@ -743,7 +946,16 @@ class ObjectPermissionMixin(object):
         )) == 1
         if not result and not is_anonymous:
             # The user-specific test failed, but does the public have access?
-            result = self.has_perm(AnonymousUser(), perm)
+            # Check the memoized permissions of the anonymous user directly
+            # instead of recursing, which would fetch it from the database
+            fq_permission = '{}.{}'.format(app_label, codename)
+            result = (
+                fq_permission in settings.ALLOWED_ANONYMOUS_PERMISSIONS and
+                len(self._get_effective_perms(
+                    user=User(pk=settings.ANONYMOUS_USER_ID),
+                    codename=codename
+                )) == 1
+            )
         if result and is_anonymous:
             # Is an anonymous user allowed to have this permission?
             fq_permission = '{}.{}'.format(app_label, codename)
@@ -796,9 +1008,11 @@ class ObjectPermissionMixin(object):
                 user_obj, implied_perm, defer_recalc=True)
         # Delete directly assigned permissions, if any
         direct_permissions.delete()
+        invalidate_perms_cache()
         if inherited_permissions.exists():
             # Delete inherited permissions
             inherited_permissions.delete()
+            invalidate_perms_cache()
             # Add a deny permission to block future inheritance
             self.assign_perm(user_obj, perm, deny=True, defer_recalc=True)
         # Remove any applicable KC permissions
@@ -6,6 +6,7 @@ from rest_framework import permissions
 from rest_framework_extensions.settings import extensions_api_settings
 
 from kpi.models.asset import Asset
+from kpi.models.object_permission import get_perms_map, perm_parse
 
 # FIXME: Move to `object_permissions` module.
 def get_perm_name(perm_name_prefix, model_instance):
@@ -48,6 +49,38 @@ class IsOwnerOrReadOnly(permissions.DjangoObjectPermissions):
     perms_map['OPTIONS']= perms_map['GET']
     perms_map['HEAD']= perms_map['GET']
 
+    def has_object_permission(self, request, view, obj):
+        ''' Same logic as `DjangoObjectPermissions.has_object_permission()`,
+        but all the user's permissions on `obj` are resolved at once instead
+        of calling `has_perm()` for each required permission '''
+        if not hasattr(obj, 'has_perm'):
+            return super(IsOwnerOrReadOnly, self).has_object_permission(
+                request, view, obj)
+
+        user_codenames = get_perms_map(request.user, [obj])[obj.pk]
+
+        def _has_perms(perms):
+            return all(
+                perm_parse(perm, obj)[1] in user_codenames for perm in perms
+            )
+
+        model_cls = type(obj)
+        perms = self.get_required_object_permissions(request.method, model_cls)
+        if not _has_perms(perms):
+            # If the user does not have permissions we need to determine if
+            # they have read permissions to see 403, or not, and simply see
+            # a 404 response.
+            if request.method in permissions.SAFE_METHODS:
+                # Read permissions already checked and failed, no need
+                # to make another lookup.
+                raise Http404
+            read_perms = self.get_required_object_permissions('GET', model_cls)
+            if not _has_perms(read_perms):
+                raise Http404
+            # Has read permissions.
+            return False
+        return True
+
 
 class PostMappedToChangePermission(IsOwnerOrReadOnly):
     '''
@@ -667,10 +667,23 @@ class AssetSerializer(serializers.HyperlinkedModelSerializer):
         if not obj.has_deployment:
             return
         if isinstance(obj.deployment.version_id, int):
-            asset_versions_uids_only = obj.asset_versions.only('uid')
             # this can be removed once the 'replace_deployment_ids'
             # migration has been run
             v_id = obj.deployment.version_id
+            try:
+                # Use the versions from `Asset.optimize_queryset_for_list()`
+                versions = obj.prefetched_latest_versions
+            except AttributeError:
+                pass
+            else:
+                for version in versions:
+                    if version._reversion_version_id == v_id:
+                        return version.uid
+                for version in versions:
+                    if version.deployed:
+                        return version.uid
+                return None
+            asset_versions_uids_only = obj.asset_versions.only('uid')
             try:
                 return asset_versions_uids_only.get(
                     _reversion_version_id=v_id
@@ -785,6 +798,7 @@ class DeploymentSerializer(serializers.Serializer):
 
 class ImportTaskSerializer(serializers.HyperlinkedModelSerializer):
     messages = ReadOnlyJSONField(required=False)
+    progress = ReadOnlyJSONField(required=False)
 
     class Meta:
         model = ImportTask
@@ -792,6 +806,7 @@ class ImportTaskSerializer(serializers.HyperlinkedModelSerializer):
             'status',
             'uid',
             'messages',
+            'progress',
             'date_created',
         )
         extra_kwargs = {
@@ -812,6 +827,7 @@ class ImportTaskListSerializer(ImportTaskSerializer):
             'url',
             'status',
             'messages',
+            'progress',
             'uid',
             'date_created',
         )
@@ -823,6 +839,7 @@ class ExportTaskSerializer(serializers.HyperlinkedModelSerializer):
         view_name='exporttask-detail'
     )
     messages = ReadOnlyJSONField(required=False)
+    progress = ReadOnlyJSONField(required=False)
     data = ReadOnlyJSONField()
 
     class Meta:
@@ -831,6 +848,7 @@ class ExportTaskSerializer(serializers.HyperlinkedModelSerializer):
             'url',
             'status',
             'messages',
+            'progress',
             'uid',
             'date_created',
             'last_submission_time',
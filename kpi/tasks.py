@@ -1,8 +1,10 @@
 from __future__ import absolute_import
-from celery import shared_task
+from celery import chord, shared_task
+from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
 from django.conf import settings
-from .models import ImportTask, ExportTask
+from django.db import transaction
+from .models import Asset, ImportTask, ExportTask
 
 @shared_task
 def update_search_index():
@@ -16,7 +18,65 @@ def import_in_background(import_task_uid):
 @shared_task
 def export_in_background(export_task_uid):
     export_task = ExportTask.objects.get(uid=export_task_uid)
-    export_task.run()
+    shard_ranges = export_task.get_shard_ranges()
+    if shard_ranges is None:
+        export_task.run()
+    elif export_task.start_sharded(len(shard_ranges)):
+        chord(
+            export_shard_in_background.s(export_task_uid, shard, start, end)
+            for shard, (start, end) in enumerate(shard_ranges)
+        )(finish_sharded_export_in_background.s(export_task_uid))
+
+@shared_task(bind=True, max_retries=settings.EXPORT_SHARD_MAX_RETRIES)
+def export_shard_in_background(self, export_task_uid, shard, start, end):
+    export_task = ExportTask.objects.get(uid=export_task_uid)
+    try:
+        part = export_task.run_shard(shard, start, end)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            ExportTask.record_shard_failure(export_task_uid, shard, e)
+            raise
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    ExportTask.record_shard_complete(export_task_uid)
+    return part
+
+@shared_task
+def finish_sharded_export_in_background(parts, export_task_uid):
+    export_task = ExportTask.objects.get(uid=export_task_uid)
+    export_task.finish_sharded(parts)
+
+@shared_task(bind=True)
+def recalculate_descendants_perms_in_background(
+        self, content_type_id, object_id):
+    content_type = ContentType.objects.get_for_id(content_type_id)
+    obj = content_type.get_object_for_this_type(pk=object_id)
+
+    def _report_progress(processed, total):
+        self.update_state(
+            state='PROGRESS', meta={'processed': processed, 'total': total})
+
+    with transaction.atomic():
+        obj.recalculate_descendants_perms(progress_callback=_report_progress)
+
+@shared_task
+def refresh_enketo_survey_links(asset_uid):
+    asset = Asset.objects.only('owner', '_deployment_data').get(uid=asset_uid)
+    if not asset.has_deployment:
+        return
+    # Contact Enketo before taking any lock
+    if asset.deployment.refresh_enketo_survey_links() is None:
+        return
+    with transaction.atomic():
+        # Merge the links into the current deployment data rather than
+        # overwriting anything a concurrent (re)deployment may have stored
+        current = Asset.objects.select_for_update().only(
+            '_deployment_data').get(pk=asset.pk)
+        deployment_data = current._deployment_data
+        if deployment_data.get('backend') != asset._deployment_data['backend']:
+            return
+        deployment_data['enketo_links'] = asset._deployment_data['enketo_links']
+        Asset.objects.filter(pk=asset.pk).update(
+            _deployment_data=deployment_data)
 
 @shared_task
 def sync_kobocat_xforms(username=None, quiet=True):
@@ -42,6 +42,12 @@ class AssetImportTaskTest(APITestCase):
         detail_response = self.client.get(response.data['url'])
         self.assertEqual(detail_response.status_code, status.HTTP_200_OK)
         self.assertEqual(detail_response.data['status'], 'complete')
+        self.assertEqual(detail_response.data['progress']['rows'], 1)
+        progress_response = self.client.get(reverse(
+            'importtask-progress', kwargs={'uid': response.data['uid']}))
+        self.assertEqual(progress_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(progress_response.data['status'], 'complete')
+        self.assertEqual(progress_response.data['progress']['phase'], 'write')
         created_details = detail_response.data['messages']['created'][0]
         self.assertEqual(created_details['kind'], 'asset')
         # Check the resulting asset
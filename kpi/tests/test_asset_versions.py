@@ -2,10 +2,11 @@ import json
 import hashlib
 import unittest
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import TestCase
 from copy import deepcopy
 
-from formpack.utils.expand_content import SCHEMA_VERSION
+from formpack.utils.expand_content import SCHEMA_VERSION, expand_content
 
 from ..models import Asset
 from ..models import AssetVersion
@@ -71,6 +72,28 @@ class AssetVersionTestCase(TestCase):
         # v2 now has 'deployed=True'
         v2_ = AssetVersion.objects.get(uid=v2.uid)
         self.assertEqual(v2_.deployed, True)
+        # and its expanded content was stored
+        self.assertEqual(
+            v2_.formpack_content,
+            expand_content(v2_._deployed_content())
+        )
+
+    def test_populate_formpack_content(self):
+        asset = Asset.objects.create(asset_type='survey', content={
+            'survey': [{'type': 'note', 'label': 'Read me', 'name': 'n1'}]
+        })
+        asset.deploy(backend='mock', active=True)
+        asset.save(create_version=False, adjust_content=False)
+        version = asset.latest_deployed_version
+        expected = version.formpack_content
+        AssetVersion.objects.filter(pk=version.pk).update(
+            formpack_content=None)
+
+        call_command('populate_formpack_content', batch_size=1, verbosity=0)
+        version = AssetVersion.objects.get(pk=version.pk)
+        self.assertEqual(version.formpack_content, expected)
+        self.assertEqual(
+            version.to_formpack_schema()['content'], expected)
 
     def test_template_asset_deployment(self):
         self.template_asset = Asset.objects.create(asset_type='template')
@@ -2,6 +2,7 @@ from django.contrib.auth.models import User, AnonymousUser, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.test import TestCase
+import mock
 
 from ..models.asset import Asset
 from ..models.collection import Collection
@@ -482,6 +483,33 @@ class ShareCollectionTests(TestCase):
                 'view_collection', self.standalone_coll))
 
 
+    def test_recalculate_descendants_perms_reports_progress(self):
+        user = self.someuser
+        asset = Asset.objects.create(
+            owner=self.coll_owner, parent=self.child_coll)
+        self.grandparent_coll.assign_perm(user, 'view_collection',
+                                          defer_recalc=True)
+        self.assertFalse(user.has_perm('view_asset', asset))
+        progress = []
+        self.grandparent_coll.recalculate_descendants_perms(
+            progress_callback=lambda done, total: progress.append(
+                (done, total))
+        )
+        # Two descendant collections and one asset
+        self.assertEqual(progress[-1], (3, 3))
+        self.assertTrue(user.has_perm('view_collection', self.child_coll))
+        self.assertTrue(user.has_perm('view_asset', asset))
+
+    def test_recalculate_descendants_perms_skips_missing_permissions(self):
+        assignable_permissions = Collection.ASSIGNABLE_PERMISSIONS + (
+            'nonexistent_permission',)
+        with mock.patch.object(Collection, 'ASSIGNABLE_PERMISSIONS',
+                               assignable_permissions):
+            self.grandparent_coll.recalculate_descendants_perms()
+        self.assertTrue(
+            self.coll_owner.has_perm('change_collection', self.child_coll))
+
+
 class DiscoverablePublicCollectionTests(TestCase):
     fixtures = ['test_data']
 
@@ -1,8 +1,12 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import time
+
+import mock
 import pytest
 
+from django.contrib.auth.models import User
 from django.test import TestCase
 from kpi.models.asset import Asset
 from kpi.models.asset_version import AssetVersion
@@ -98,3 +102,47 @@ class MockDeployment(TestCase):
         self.assertTrue(self.asset.has_deployment)
         self.asset.deployment.delete()
         self.assertFalse(self.asset.has_deployment)
+
+    def test_deployment_is_memoized(self):
+        deployment = self.asset.deployment
+        self.assertIs(self.asset.deployment, deployment)
+        self.asset.deployment.delete()
+        self.asset.connect_deployment(backend='mock')
+        self.assertIs(self.asset.deployment.asset, self.asset)
+
+
+class KobocatEnketoLinks(TestCase):
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.asset = Asset.objects.create(
+            owner=User.objects.get(username='someuser'),
+            content={'survey': [{u'type': 'text', u'name': 'q1'}]}
+        )
+        self.asset._deployment_data = {
+            'backend': 'kobocat',
+            'backend_response': {'id_string': self.asset.uid},
+        }
+
+    def test_fresh_links_are_served_from_deployment_data(self):
+        links = {'url': 'https://enke.to/::self'}
+        self.asset.deployment.store_data({
+            'enketo_links': {
+                'key': ['someuser', self.asset.uid],
+                'links': links,
+                'retrieved': time.time(),
+            }
+        })
+        self.assertEqual(
+            self.asset.deployment.get_enketo_survey_links(), links)
+
+    def test_missing_links_are_refreshed_once(self):
+        Asset.objects.filter(pk=self.asset.pk).update(
+            _deployment_data=self.asset._deployment_data)
+        with mock.patch('kpi.tasks.refresh_enketo_survey_links.delay') as delay:
+            self.assertEqual(self.asset.deployment.get_enketo_survey_links(), {})
+            # Another request for the same asset
+            asset = Asset.objects.get(pk=self.asset.pk)
+            self.assertEqual(asset.deployment.get_enketo_survey_links(), {})
+        delay.assert_called_once_with(self.asset.uid)
+        self.assertIn('last_attempt', asset._deployment_data['enketo_links'])
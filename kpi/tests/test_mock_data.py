@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 from copy import deepcopy
 import json
+import mock
 from collections import OrderedDict
 
 from django.contrib.auth.models import User
@@ -148,6 +149,83 @@ class MockDataReports(TestCase):
                              u'\u0627\u0644\u062e\u064a\u0627\u0631 \u0627\u0644\u062b\u0627\u0646\u064a'])
         self.assertEqual(responses, expected)
 
+    def test_kobo_apps_reports_report_data_aggregated(self):
+        # `Text` cannot be aggregated and must still be streamed
+        field_names = ['Select_one', 'Select_Many', 'Number', 'Decimal',
+                       'Text']
+        deployment = self.asset.deployment
+        for split_by in None, 'Select_one':
+            streamed = report_data.data_by_identifiers(
+                self.asset, field_names=field_names, split_by=split_by,
+                submission_stream=deployment.get_submissions()
+            )
+            count_values = mock.Mock(
+                wraps=deployment.get_submission_value_counts)
+            with mock.patch.object(
+                    deployment, 'get_submission_value_counts', count_values):
+                aggregated = report_data.data_by_identifiers(
+                    self.asset, field_names=field_names, split_by=split_by)
+            self.assertTrue(count_values.called)
+            if split_by:
+                # Submissions are counted per pair of values, one field at
+                # a time
+                for args, _ in count_values.call_args_list:
+                    self.assertEqual(args[0][0], split_by)
+                    self.assertEqual(len(args[0]), 2)
+            self.assertEqual(aggregated, streamed)
+
+    def test_kobo_apps_reports_report_data_cached(self):
+        field_names = ['Select_one', 'Number']
+        deployment = self.asset.deployment
+        submissions = list(deployment.get_submissions())
+        for _id, submission in enumerate(submissions, 1):
+            submission['_id'] = _id
+        deployment.mock_submissions(submissions)
+        report_data.data_by_identifiers(self.asset, field_names=field_names)
+
+        def assert_counted(expected_calls):
+            count_values = mock.Mock(
+                wraps=deployment.get_submission_value_counts)
+            get_id_range = mock.Mock(
+                wraps=deployment.get_submission_id_range)
+            with mock.patch.object(
+                    deployment, 'get_submission_value_counts', count_values), \
+                    mock.patch.object(
+                        deployment, 'get_submission_id_range', get_id_range):
+                aggregated = report_data.data_by_identifiers(
+                    self.asset, field_names=field_names)
+            self.assertEqual(count_values.call_args_list, expected_calls)
+            # Once per report, not per field
+            get_id_range.assert_called_once_with()
+            self.assertEqual(aggregated, report_data.data_by_identifiers(
+                self.asset, field_names=field_names,
+                submission_stream=deployment.get_submissions()
+            ))
+
+        # Only the new submission is counted
+        new_submission = deepcopy(submissions[-1])
+        new_submission['_id'] = 5
+        submissions.append(new_submission)
+        deployment.mock_submissions(submissions)
+        assert_counted([
+            mock.call([path], start_after=4, end_at=5)
+            for path in field_names
+        ])
+        # Nothing is counted without new submissions
+        assert_counted([])
+        # Everything is counted again after a deletion
+        submissions.pop(0)
+        new_submission = deepcopy(submissions[-1])
+        new_submission['_id'] = 6
+        submissions.append(new_submission)
+        deployment.mock_submissions(submissions)
+        assert_counted([
+            call for path in field_names for call in (
+                mock.call([path], start_after=5, end_at=6),
+                mock.call([path], end_at=6),
+            )
+        ])
+
     def test_kobo_apps_reports_report_data_subset(self):
         values = report_data.data_by_identifiers(self.asset,
                                                  field_names=('Select_one',),
@@ -237,3 +315,46 @@ class MockDataReports(TestCase):
         self.assertEqual(self.asset.asset_versions.count(), 2)
         self.assertTrue(self.asset.has_deployment)
         self.assertEqual(self.asset.deployment.submission_count, 4)
+
+    def test_formpack_is_cached_until_deployment(self):
+        build = mock.Mock(wraps=report_data._build_formpack)
+        with mock.patch.object(report_data, '_build_formpack', build):
+            pack, _ = report_data.build_formpack(self.asset)
+            cached_pack, _ = report_data.build_formpack(self.asset)
+            self.assertEqual(build.call_count, 1)
+            # Each call gets its own copy
+            self.assertIsNot(cached_pack, pack)
+            self.assertEqual(cached_pack.versions.keys(), pack.versions.keys())
+
+            self.asset.content['survey'].append(
+                {'type': 'text', 'name': 'new_question',
+                 'label': ['New question', 'Pregunta nueva', None]})
+            self.asset.save()
+            self.asset.deploy(backend='mock', active=True)
+            redeployed_pack, _ = report_data.build_formpack(self.asset)
+            self.assertEqual(build.call_count, 2)
+            self.assertIn(
+                self.asset.latest_deployed_version.uid,
+                redeployed_pack.versions.keys()
+            )
+
+    def test_version_id_resolver(self):
+        infer_version_id = report_data._build_version_id_resolver(
+            ['v3', 'v3_alias', 'v2', 'v1'], {'1001': 'v1', '1002': 'v2'})
+
+        def inferred(submission):
+            return infer_version_id(submission)[
+                report_data.INFERRED_VERSION_ID_KEY]
+
+        self.assertEqual(inferred({'__version__': 'v3'}), 'v3')
+        self.assertEqual(inferred({'__version__': 'v3_alias'}), 'v3_alias')
+        # The newest version found under any version key wins
+        self.assertEqual(
+            inferred({'__version__': 'v1', '_version__001': 'v2'}), 'v2')
+        self.assertEqual(
+            inferred({'__version__': 'v1', '_version_': '1002'}), 'v2')
+        self.assertEqual(inferred({'_version__002': '1001'}), 'v1')
+        # Unknown ids, and values that cannot be version ids, are ignored
+        self.assertEqual(
+            inferred({'__version__': 'vX', 'group_version_1': [{}]}), 'v3')
+        self.assertEqual(inferred({}), 'v3')
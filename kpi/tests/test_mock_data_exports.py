@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 import os
 import mock
+import tempfile
 import xlrd
 import zipfile
 import datetime
@@ -414,6 +415,187 @@ class MockDataExports(TestCase):
                 '\r\n'.join(content_lines)
             )
 
+    def test_incremental_csv_export(self):
+        task_data = {
+            'source': reverse('asset-detail', args=[self.asset.uid]),
+            'type': 'csv',
+            'lang': 'English',
+            'tag_cols_for_header': [],
+            'incremental': 'true',
+        }
+        previous_export = ExportTask.objects.create(
+            user=self.user, data=task_data)
+        previous_export.run()
+        self.assertEqual(previous_export.status, ExportTask.COMPLETE)
+        self.assertIn('processing_time_seconds', previous_export.data)
+
+        new_submission = dict(self.submissions[-1])
+        new_submission.update({
+            '_id': 64,
+            '_uuid': 'c3fa3a4a-7a3c-4fcf-b0e8-6e4c4f4cbd8b',
+            '_submission_time': '2017-10-24T08:00:00',
+        })
+        self.asset.deployment.mock_submissions(
+            self.submissions + [new_submission])
+
+        export_task = ExportTask.objects.create(
+            user=self.user, data=task_data)
+        # The diagnostic information `run()` adds to `data` does not prevent
+        # the previous export from being found
+        self.assertEqual(
+            export_task._get_previous_export(self.asset, task_data['source']),
+            previous_export
+        )
+        messages = defaultdict(list)
+        export_task._run_task(messages)
+        self.assertFalse(messages)
+        expected_lines = [
+            '"start";"end";"What kind of symmetry do you have?";"What kind of symmetry do you have?/Spherical";"What kind of symmetry do you have?/Radial";"What kind of symmetry do you have?/Bilateral";"How many segments does your body have?";"Do you have body fluids that occupy intracellular space?";"Do you descend from an ancestral unicellular organism?";"_id";"_uuid";"_submission_time";"_validation_status";"_index"',
+            '"2017-10-23T05:40:39.000-04:00";"2017-10-23T05:41:13.000-04:00";"Spherical Radial Bilateral";"1";"1";"1";"6";"Yes, and some extracellular space";"No";"61";"48583952-1892-4931-8d9c-869e7b49bafb";"2017-10-23T09:41:19";"";"1"',
+            '"2017-10-23T05:41:14.000-04:00";"2017-10-23T05:41:32.000-04:00";"Radial";"0";"1";"0";"3";"Yes";"No";"62";"317ba7b7-bea4-4a8c-8620-a483c3079c4b";"2017-10-23T09:41:38";"";"2"',
+            '"2017-10-23T05:41:32.000-04:00";"2017-10-23T05:42:05.000-04:00";"Bilateral";"0";"0";"1";"2";"No / Unsure";"Yes";"63";"3f15cdfe-3eab-4678-8352-7806febf158d";"2017-10-23T09:42:11";"";"3"',
+            '"2017-10-23T05:41:32.000-04:00";"2017-10-23T05:42:05.000-04:00";"Bilateral";"0";"0";"1";"2";"No / Unsure";"Yes";"64";"c3fa3a4a-7a3c-4fcf-b0e8-6e4c4f4cbd8b";"2017-10-24T08:00:00";"";"4"',
+        ]
+        expected_lines = [
+            (line + '\r\n').encode('utf-8') for line in expected_lines
+        ]
+        self.assertEqual(list(export_task.result), expected_lines)
+        self.assertEqual(
+            export_task.last_submission_time.strftime('%Y-%m-%dT%H:%M:%S'),
+            '2017-10-24T08:00:00'
+        )
+
+    def test_reuse_identical_export(self):
+        task_data = {
+            'source': reverse('asset-detail', args=[self.asset.uid]),
+            'type': 'csv',
+        }
+        export_task = ExportTask.objects.create(
+            user=self.user, data=task_data)
+        # A running export is shared by identical requests
+        self.assertEqual(
+            ExportTask.get_reusable(self.user, dict(task_data), self.asset),
+            export_task
+        )
+        export_task.run()
+        self.assertEqual(export_task.status, ExportTask.COMPLETE)
+        # So is a complete one, as long as it is up to date
+        self.assertEqual(
+            ExportTask.get_reusable(self.user, dict(task_data), self.asset),
+            export_task
+        )
+        self.assertIsNone(ExportTask.get_reusable(
+            self.user, dict(task_data, lang='English'), self.asset))
+
+        new_submission = dict(self.submissions[-1])
+        new_submission.update({
+            '_id': 64,
+            '_submission_time': (
+                datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+            ).strftime('%Y-%m-%dT%H:%M:%S'),
+        })
+        self.asset.deployment.mock_submissions(
+            self.submissions + [new_submission])
+        self.assertIsNone(
+            ExportTask.get_reusable(self.user, dict(task_data), self.asset))
+
+    def test_upload_in_chunks_writes_bounded_chunks(self):
+        '''
+        Copying a result to storage must not read it into memory at once,
+        whatever its size
+        '''
+        class RecordingFile(object):
+            largest_write = 0
+            def __init__(self, f):
+                self.f = f
+            def write(self, data):
+                self.largest_write = max(self.largest_write, len(data))
+                self.f.write(data)
+
+        chunk_size = 1024 * 1024
+        megabyte_of_zeros = b'\0' * 1024 * 1024
+        with self.settings(EXPORT_UPLOAD_CHUNK_SIZE=chunk_size):
+            for megabytes in (16, 64):
+                with tempfile.TemporaryFile() as source, \
+                        tempfile.TemporaryFile() as destination:
+                    for _ in range(megabytes):
+                        source.write(megabyte_of_zeros)
+                    source.seek(0)
+                    output_file = RecordingFile(destination)
+                    ExportTask._upload_in_chunks(source, output_file)
+                    self.assertEqual(
+                        destination.tell(), megabytes * 1024 * 1024)
+                    self.assertLessEqual(output_file.largest_write, chunk_size)
+
+    def test_export_progress(self):
+        export_task = ExportTask.objects.create(user=self.user, data={
+            'source': reverse('asset-detail', args=[self.asset.uid]),
+            'type': 'csv',
+        })
+        saved_progress = []
+        original_save = ExportTask.save
+        def save(task, *args, **kwargs):
+            if 'progress' in (kwargs.get('update_fields') or ()):
+                saved_progress.append(dict(task.progress))
+            return original_save(task, *args, **kwargs)
+
+        with self.settings(IMPORT_EXPORT_PROGRESS_INTERVAL=0), \
+                mock.patch.object(ExportTask, 'save', save):
+            export_task.run()
+        self.assertEqual(export_task.status, ExportTask.COMPLETE)
+        progress = ExportTask.objects.get(pk=export_task.pk).progress
+        self.assertEqual(progress['phase'], ExportTask.WRITE)
+        self.assertEqual(progress['rows'], len(self.submissions))
+        self.assertEqual(progress['bytes'], export_task.result.size)
+        self.assertGreater(progress['rows_per_second'], 0)
+        # Each phase is saved as it starts, along with intermediate counts
+        self.assertEqual(
+            [p['phase'] for p in saved_progress if p['rows'] == 0][:3],
+            [None, ExportTask.FETCH, ExportTask.WRITE]
+        )
+        self.assertIn(1, [p['rows'] for p in saved_progress])
+
+    def test_sharded_csv_export(self):
+        task_data = {
+            'source': reverse('asset-detail', args=[self.asset.uid]),
+            'type': 'csv',
+        }
+        export_task = ExportTask.objects.create(
+            user=self.user, data=task_data)
+        with self.settings(EXPORT_SHARDS=2,
+                           EXPORT_SHARDING_MIN_SUBMISSIONS=1):
+            shard_ranges = export_task.get_shard_ranges()
+        self.assertEqual(shard_ranges, [(60, 61), (61, 63)])
+
+        self.assertTrue(export_task.start_sharded(len(shard_ranges)))
+        parts = []
+        for shard, (start, end) in enumerate(shard_ranges):
+            parts.append(export_task.run_shard(shard, start, end))
+            ExportTask.record_shard_complete(export_task.uid)
+        export_task = ExportTask.objects.get(uid=export_task.uid)
+        self.assertEqual(
+            export_task.messages['shards'], {'total': 2, 'complete': 2})
+        export_task.finish_sharded(parts)
+
+        self.assertEqual(export_task.status, ExportTask.COMPLETE)
+        for part in parts:
+            self.assertFalse(export_task.result.storage.exists(part['name']))
+        expected_lines = [
+            '"start";"end";"¿Qué tipo de simetría tiene?";"¿Qué tipo de simetría tiene?/Esférico";"¿Qué tipo de simetría tiene?/Radial";"¿Qué tipo de simetría tiene?/Bilateral";"¿Cuántos segmentos tiene tu cuerpo?";"¿Tienes fluidos corporales que ocupan espacio intracelular?";"¿Desciende de un organismo unicelular ancestral?";"_id";"_uuid";"_submission_time";"_validation_status";"_index"',
+            '"";"";"#symmetry";"#symmetry";"#symmetry";"#symmetry";"#segments";"#fluids";"";"";"";"";"";""',
+            '"2017-10-23T05:40:39.000-04:00";"2017-10-23T05:41:13.000-04:00";"Esférico Radial Bilateral";"1";"1";"1";"6";"Sí, y algún espacio extracelular";"No";"61";"48583952-1892-4931-8d9c-869e7b49bafb";"2017-10-23T09:41:19";"";"1"',
+            '"2017-10-23T05:41:14.000-04:00";"2017-10-23T05:41:32.000-04:00";"Radial";"0";"1";"0";"3";"Sí";"No";"62";"317ba7b7-bea4-4a8c-8620-a483c3079c4b";"2017-10-23T09:41:38";"";"2"',
+            '"2017-10-23T05:41:32.000-04:00";"2017-10-23T05:42:05.000-04:00";"Bilateral";"0";"0";"1";"2";"No / Inseguro";"Sí";"63";"3f15cdfe-3eab-4678-8352-7806febf158d";"2017-10-23T09:42:11";"";"3"',
+        ]
+        expected_lines = [
+            (line + '\r\n').encode('utf-8') for line in expected_lines
+        ]
+        self.assertEqual(list(export_task.result), expected_lines)
+        self.assertEqual(
+            export_task.last_submission_time.strftime('%Y-%m-%dT%H:%M:%S'),
+            '2017-10-23T09:42:11'
+        )
+
     def test_remove_excess_exports(self):
         task_data = {
             'source': reverse('asset-detail', args=[self.asset.uid]),
@@ -155,3 +155,10 @@ class MongoBase64Decoding(TestCase):
         decoded = list(get_instances_from_mongo())
         expected_results = decoded_results
         self.assertEqual(decoded, expected_results)
+
+    def test_encoding_reverses_decoding(self):
+        for key in ('dot.dot.dot', '$dollar.sign', 'regular', 'group/q.1'):
+            encoded = MongoDecodingHelper.encode(key)
+            self.assertNotIn('.', encoded)
+            self.assertFalse(encoded.startswith('$'))
+            self.assertEqual(MongoDecodingHelper.decode(encoded), key)
@@ -1,3 +1,4 @@
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
@@ -5,7 +6,12 @@ from django.test import TestCase
 
 from ..models.asset import Asset
 from ..models.collection import Collection
-from ..models.object_permission import get_all_objects_for_user
+from ..models.object_permission import (
+    get_all_objects_for_user,
+    get_objects_for_user,
+    get_perms_map,
+    prefetch_perms,
+)
 
 
 class BasePermissionsTestCase(TestCase):
@@ -476,6 +482,27 @@ class PermissionsTestCase(BasePermissionsTestCase):
         self.assertNotIn(self.admin_asset, someuser_assets)
         self.assertNotIn(self.admin_collection, someuser_collections)
 
+    def test_get_objects_for_user_including_public(self):
+        grantee = self.someuser
+        public_asset = Asset.objects.create(owner=self.admin)
+        public_asset.assign_perm(AnonymousUser(), 'view_asset')
+        self.admin_asset.assign_perm(grantee, 'change_asset')
+        admin_assets = Asset.objects.filter(owner=self.admin)
+        self.assertListEqual(
+            list(get_objects_for_user(grantee, 'view_asset', admin_assets)),
+            [self.admin_asset]
+        )
+        self.assertListEqual(
+            list(get_objects_for_user(
+                grantee, ['view_asset', 'change_asset'], admin_assets)),
+            [self.admin_asset]
+        )
+        self.assertSetEqual(
+            set(get_objects_for_user(
+                grantee, 'view_asset', admin_assets, include_public=True)),
+            set([self.admin_asset, public_asset])
+        )
+
     def test_copy_permissions_between_objects(self):
 
         new_admin_asset_1 = Asset.objects.create(content={'survey': [
@@ -509,3 +536,52 @@ class PermissionsTestCase(BasePermissionsTestCase):
 
         self.assertListEqual(
             sorted(new_admin_asset_2.get_perms(self.someuser)), expected_permissions)
+
+    def test_memoized_permissions(self):
+        asset = self.admin_asset
+        grantee = self.someuser
+        asset.assign_perm(grantee, 'view_asset')
+        # Warm up the process-wide cache of `Permission` primary keys
+        self.assertTrue(asset.has_perm(grantee, 'view_asset'))
+        prefetch_perms([asset])
+        with self.assertNumQueries(0):
+            self.assertTrue(asset.has_perm(grantee, 'view_asset'))
+            self.assertFalse(asset.has_perm(grantee, 'share_asset'))
+            self.assertFalse(asset.has_perm(grantee, 'change_asset'))
+        # Writing permissions must discard the memoized ones
+        asset.assign_perm(grantee, 'change_asset')
+        self.assertTrue(asset.has_perm(grantee, 'change_asset'))
+        self.assertTrue(asset.has_perm(grantee, 'share_asset'))
+        asset.remove_perm(grantee, 'change_asset')
+        self.assertFalse(asset.has_perm(grantee, 'change_asset'))
+
+    def test_stale_prefetched_permissions_are_reloaded(self):
+        grantee = self.someuser
+        asset = Asset.objects.prefetch_related('permissions').get(
+            pk=self.admin_asset.pk)
+        # Permissions change after they are prefetched, but before they are
+        # read for the first time
+        self.admin_asset.assign_perm(grantee, 'view_asset')
+        self.assertTrue(asset.has_perm(grantee, 'view_asset'))
+
+    def test_get_perms_map(self):
+        grantee = self.someuser
+        assets = [self.admin_asset]
+        for i in range(3):
+            assets.append(Asset.objects.create(owner=self.admin))
+        assets[0].assign_perm(grantee, 'change_asset')
+        assets[1].assign_perm(grantee, 'view_submissions')
+        # Fetch fresh instances so that nothing is memoized yet
+        assets = list(Asset.objects.filter(pk__in=[a.pk for a in assets]))
+        perms_map = get_perms_map(grantee, assets)
+        for asset in assets:
+            for codename in self.asset_owner_permissions:
+                self.assertEqual(
+                    codename in perms_map[asset.pk],
+                    asset.has_perm(grantee, codename)
+                )
+        self.assertSetEqual(
+            get_perms_map(self.admin, [self.admin_asset])[self.admin_asset.pk]
+                .intersection(self.asset_owner_permissions),
+            set(self.asset_owner_permissions)
+        )
@@ -14,6 +14,16 @@ class MongoDecodingHelper(object):
         (re.compile(r'^' + base64.encodestring('$').strip()), '$'),
         (re.compile(base64.encodestring('.').strip()), '.'),
     ]
+    ENCODING_SUBSTITUTIONS = [
+        (re.compile(r'^\$'), base64.encodestring('$').strip()),
+        (re.compile(r'\.'), base64.encodestring('.').strip()),
+    ]
+
+    # Maps each key seen so far to its decoded form, or to `None` if it is
+    # not encoded. Submissions to the same form share their keys, so in
+    # practice each distinct key is only checked and decoded once
+    _decoded_keys = {}
+    DECODED_KEYS_CACHE_SIZE = 50000
 
     @classmethod
     def to_readable_dict(cls, d):
@@ -22,23 +32,68 @@ class MongoDecodingHelper(object):
         For example:
         { "myLg==attribute": True } => { "my.attribute": True }
 
+        Nested dicts are updated in place as well.
+
         :param d: dict
         :return: dict
         """
+        decoded_keys = cls._decoded_keys
+        renamed = None
+        for key, value in d.iteritems():
+            value_type = type(value)
+            if value_type is list:
+                for e in value:
+                    if type(e) is dict:
+                        cls.to_readable_dict(e)
+            elif value_type is dict:
+                cls.to_readable_dict(value)
 
-        for key, value in list(d.items()):
-            if type(value) == list:
-                value = [cls.to_readable_dict(e)
-                         if type(e) == dict else e for e in value]
-            elif type(value) == dict:
-                value = cls.to_readable_dict(value)
+            try:
+                decoded_key = decoded_keys[key]
+            except KeyError:
+                decoded_key = cls._decode_key(key)
+            if decoded_key is not None:
+                if renamed is None:
+                    renamed = []
+                renamed.append((key, decoded_key))
 
-            if cls._is_attribute_encoded(key):
-                del d[key]
-                d[cls.decode(key)] = value
+        if renamed is not None:
+            for key, decoded_key in renamed:
+                d[decoded_key] = d.pop(key)
 
         return d
 
+    @classmethod
+    def _decode_key(cls, key):
+        """
+        Decodes `key` and remembers the result for subsequent calls to
+        `to_readable_dict()`.
+
+        :param key: string
+        :return: string, or `None` if `key` is not encoded
+        """
+        if len(cls._decoded_keys) >= cls.DECODED_KEYS_CACHE_SIZE:
+            cls._decoded_keys.clear()
+        if cls._is_attribute_encoded(key):
+            decoded_key = cls.decode(key)
+        else:
+            decoded_key = None
+        cls._decoded_keys[key] = decoded_key
+        return decoded_key
+
+    @classmethod
+    def encode(cls, key):
+        """
+        Replace characters not allowed in Mongo keys with their base64-encoded
+        representations, e.g. to build a projection
+
+        :param key: string
+        :return: string
+        """
+        for pattern, repl in cls.ENCODING_SUBSTITUTIONS:
+            key = re.sub(pattern, repl, key)
+        return key
+
     @classmethod
     def decode(cls, key):
         """
@@ -455,7 +455,25 @@ class XlsFormParser(MultiPartParser):
     pass
 
 
-class ImportTaskViewSet(viewsets.ReadOnlyModelViewSet):
+class ImportExportTaskProgressMixin(object):
+    @detail_route(methods=['get'])
+    def progress(self, request, *args, **kwargs):
+        '''
+        Report only the status and progress of the task, leaving out its
+        potentially large `data` and `messages`, for cheap polling
+        '''
+        queryset = self.get_queryset().only('uid', 'status', 'progress')
+        task = get_object_or_404(queryset, uid=kwargs[self.lookup_field])
+        self.check_object_permissions(request, task)
+        return Response({
+            'uid': task.uid,
+            'status': task.status,
+            'progress': task.progress,
+        })
+
+
+class ImportTaskViewSet(ImportExportTaskProgressMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = ImportTask.objects.all()
     serializer_class = ImportTaskSerializer
     lookup_field = 'uid'
@@ -507,7 +525,7 @@ class ImportTaskViewSet(viewsets.ReadOnlyModelViewSet):
         }, status.HTTP_201_CREATED)
 
 
-class ExportTaskViewSet(NoUpdateModelViewSet):
+class ExportTaskViewSet(ImportExportTaskProgressMixin, NoUpdateModelViewSet):
     queryset = ExportTask.objects.all()
     serializer_class = ExportTaskSerializer
     lookup_field = 'uid'
@@ -554,6 +572,7 @@ class ExportTaskViewSet(NoUpdateModelViewSet):
             'lang',
             'hierarchy_in_labels',
             'fields_from_all_versions',
+            'incremental',
         )
         task_data = {}
         for opt in valid_options:
@@ -575,19 +594,31 @@ class ExportTaskViewSet(NoUpdateModelViewSet):
         if not source.has_deployment:
             raise exceptions.ValidationError(
                 {'source': 'The specified asset must be deployed.'})
-        # Create a new export task
-        export_task = ExportTask.objects.create(user=request.user,
-                                                data=task_data)
-        # Have Celery run the export in the background
-        export_in_background.delay(export_task_uid=export_task.uid)
+        with transaction.atomic():
+            # Lock the user so that concurrent identical requests coalesce
+            # onto a single export task
+            User.objects.select_for_update().get(pk=request.user.pk)
+            # Reuse an identical export that is still running or up to date
+            export_task = ExportTask.get_reusable(
+                request.user, task_data, source)
+            if export_task is None:
+                # Create a new export task
+                export_task = ExportTask.objects.create(user=request.user,
+                                                        data=task_data)
+                created = True
+            else:
+                created = False
+        if created:
+            # Have Celery run the export in the background
+            export_in_background.delay(export_task_uid=export_task.uid)
         return Response({
             'uid': export_task.uid,
             'url': reverse(
                 'exporttask-detail',
                 kwargs={'uid': export_task.uid},
                 request=request),
-            'status': ExportTask.PROCESSING
-        }, status.HTTP_201_CREATED)
+            'status': ExportTask.PROCESSING if created else export_task.status
+        }, status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 class AssetSnapshotViewSet(NoUpdateModelViewSet):
@@ -734,13 +765,24 @@ class SubmissionViewSet(NestedViewSetMixin, viewsets.ViewSet,
         try:
             asset_uid = self.get_parents_query_dict().get("asset")
             asset = get_object_or_404(self.parent_model, uid=asset_uid)
-            instance_id = request.data.get("instance_id")
-            if not HookUtils.call_services(asset, instance_id):
-                response_status_code = status.HTTP_409_CONFLICT
-                response = {
-                    "detail": _(
-                        "Your data for instance {} has been already submitted.".format(instance_id))
-                }
+            if "instance_ids" in request.data:
+                # Several instances notified at once, e.g. by a bulk operation
+                # in KoBoCAT
+                instances_ids = request.data.getlist("instance_ids") \
+                    if hasattr(request.data, "getlist") else request.data.get("instance_ids")
+                if not HookUtils.call_services_in_bulk(asset, instances_ids):
+                    response_status_code = status.HTTP_409_CONFLICT
+                    response = {
+                        "detail": _("Your data for these instances has been already submitted.")
+                    }
+            else:
+                instance_id = request.data.get("instance_id")
+                if not HookUtils.call_services(asset, instance_id):
+                    response_status_code = status.HTTP_409_CONFLICT
+                    response = {
+                        "detail": _(
+                            "Your data for instance {} has been already submitted.".format(instance_id))
+                    }
 
         except Exception as e:
             logging.error("SubmissionViewSet.create - {}".format(str(e)))